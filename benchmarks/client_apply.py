@@ -0,0 +1,57 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from client_store import PersonnelStore
+
+def build_personnel(count):
+    return [{"name": f"Name{i}", "surname": f"Surname{i}", "ssn": f"{i:011d}"} for i in range(count)]
+
+def apply_row_by_row(database_file, personnel_list):
+    # The apply path clients used before PersonnelStore: one connection and one commit per row.
+    for personnel in personnel_list:
+        conn = sqlite3.connect(database_file)
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO personnel (NAME, SURNAME, SSN) VALUES (?, ?, ?)",
+            (personnel["name"], personnel["surname"], personnel["ssn"])
+        )
+        conn.commit()
+        conn.close()
+
+def apply_batch(store, personnel_list):
+    store.save_personnel(personnel_list, replace=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure client SAVE_ALL apply throughput.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--row-by-row-rows", type=int, default=2000, help="rows for the much slower row-by-row path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_file = os.path.join(directory, "legacy.db")
+        PersonnelStore(legacy_file).close()
+
+        # The legacy clients used SQLite's default rollback journal with full sync.
+        conn = sqlite3.connect(legacy_file)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        personnel_list = build_personnel(args.row_by_row_rows)
+        start = time.perf_counter()
+        apply_row_by_row(legacy_file, personnel_list)
+        elapsed = time.perf_counter() - start
+        print(f"Row by row: {len(personnel_list)} rows in {elapsed:.3f}s, {len(personnel_list) / elapsed:,.0f} rows/s")
+
+        store = PersonnelStore(os.path.join(directory, "batch.db"))
+        personnel_list = build_personnel(args.rows)
+        start = time.perf_counter()
+        apply_batch(store, personnel_list)
+        elapsed = time.perf_counter() - start
+        store.close()
+        print(f"Batched:    {len(personnel_list)} rows in {elapsed:.3f}s, {len(personnel_list) / elapsed:,.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
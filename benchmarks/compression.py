@@ -0,0 +1,42 @@
+import argparse
+import json
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.encrypt_once import build_save_all_message
+from codec import ENCODING_COMPACT, ENCODING_JSON, encode_message
+from compression import AVAILABLE_COMPRESSIONS, FLAGS, compress, decompress
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare compression ratio and time of a SAVE_ALL payload per algorithm.")
+    parser.add_argument("--personnel", type=int, default=100000)
+    args = parser.parse_args()
+
+    fernet = Fernet(Fernet.generate_key())
+    message = json.loads(build_save_all_message(args.personnel))
+
+    print(f"SAVE_ALL with {args.personnel} personnel")
+
+    for encoding in (ENCODING_JSON, ENCODING_COMPACT):
+        payload = encode_message(message, encoding)
+        print(f"{encoding}: {len(payload) / 1024 / 1024:.2f} MB raw, {len(fernet.encrypt(payload)) / 1024 / 1024:.2f} MB encrypted")
+
+        for algorithm in AVAILABLE_COMPRESSIONS:
+            compress_time, compressed = timed(compress, payload, algorithm)
+            decompress_time, restored = timed(decompress, compressed, FLAGS[algorithm])
+            assert restored == payload
+
+            encrypted = fernet.encrypt(compressed)
+            print(
+                f"  {algorithm:5} {len(encrypted) / 1024 / 1024:6.2f} MB encrypted, ratio {len(payload) / len(compressed):5.1f}x, "
+                f"compress {compress_time * 1000:7.1f} ms, decompress {decompress_time * 1000:6.1f} ms"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import time
+
+from cryptography.fernet import Fernet
+
+from protocol import encode_frame
+
+def build_save_all_message(personnel_count):
+    message = {
+        "action": "SAVE_ALL",
+        "personnel": [
+            {"name": f"Name{i}", "surname": f"Surname{i}", "ssn": f"{i // 10000 % 1000:03d}-{i // 100 % 100:02d}-{i % 10000:04d}"}
+            for i in range(personnel_count)
+        ]
+    }
+    return json.dumps(message)
+
+def encrypt_per_recipient(fernet, message_json, recipients):
+    frames = []
+    for _ in range(recipients):
+        frames.append(encode_frame(fernet.encrypt(message_json.encode())))
+    return frames
+
+def encrypt_once(fernet, message_json, recipients):
+    frame = memoryview(encode_frame(fernet.encrypt(message_json.encode())))
+    return [frame] * recipients
+
+def measure(function, fernet, message_json, recipients):
+    start = time.process_time()
+    function(fernet, message_json, recipients)
+    return time.process_time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-recipient and encrypt-once broadcast CPU cost.")
+    parser.add_argument("--personnel", type=int, default=50000)
+    parser.add_argument("--recipients", type=int, default=200)
+    args = parser.parse_args()
+
+    fernet = Fernet(Fernet.generate_key())
+    message_json = build_save_all_message(args.personnel)
+
+    print(f"Payload: {len(message_json) / 1024 / 1024:.2f} MB of JSON, {args.recipients} recipients")
+
+    per_recipient = measure(encrypt_per_recipient, fernet, message_json, args.recipients)
+    once = measure(encrypt_once, fernet, message_json, args.recipients)
+
+    print(f"Encrypt per recipient: {per_recipient:.3f}s CPU, {per_recipient / args.recipients * 1000:.3f} ms per recipient")
+    print(f"Encrypt once:          {once:.3f}s CPU, {once / args.recipients * 1000:.3f} ms per recipient")
+    print(f"CPU saved per recipient: {(per_recipient - once) / args.recipients * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+
+from cryptography.fernet import Fernet
+
+def prepare_server_environment(directory, database_url, server_port=0):
+    # server.py reads its key from the working directory and its settings from the environment at import time.
+    with open(os.path.join(directory, "fernet_key.key"), "wb") as f:
+        f.write(Fernet.generate_key())
+
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["SERVER_HOST"] = "127.0.0.1"
+    os.environ["SERVER_PORT"] = str(server_port)
+    os.chdir(directory)
+
+def sqlite_database_url(directory):
+    return f"sqlite:///{os.path.join(directory, 'server.db')}?timeout=30"
@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.error import URLError
+
+from cryptography.fernet import Fernet
+
+from benchmarks.environment import prepare_server_environment, sqlite_database_url
+from codec import ENCODING_COMPACT, ENCODING_JSON, SUPPORTED_ENCODINGS, decode_message
+from compression import AVAILABLE_COMPRESSIONS, decompress
+from control_cli import call
+from protocol import (
+    FLAG_COMPACT, HEADER, MESSAGE_TYPE_ACK, MESSAGE_TYPE_DATA, MESSAGE_TYPE_HELLO, MESSAGE_TYPE_PING,
+    MESSAGE_TYPE_PONG, MESSAGE_TYPE_WELCOME, ProtocolError, encode_frame, read_frame_async
+)
+from session_cipher import DIRECTION_TO_SERVER, SUPPORTED_CIPHERS, SessionCipher, new_handshake_nonce
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+# The server refuses to enable the control API without a token, so each run makes up its own.
+CONTROL_TOKEN = secrets.token_hex(16)
+
+# The last message of every operation; a client has caught up with an operation once it receives one of these.
+COMPLETING_ACTIONS = ("SAVE", "DELETE", "SAVE_ALL", "SYNC", "SNAPSHOT_END", "DELETE_ALL")
+
+class SimulatedClient:
+    def __init__(self, fernet_key):
+        self.fernet_key = fernet_key
+        self.fernet = Fernet(fernet_key)
+        self.session_cipher = None
+        self.ack_cipher = None
+
+        self.port = None
+        self.messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.completed = 0
+        self.completed_at = None
+        self.error = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.port = self.writer.get_extra_info("sockname")[1]
+        self.nonce = new_handshake_nonce()
+
+        # Same hello as a fresh client1.py, but the messages are only decoded, never written to a database.
+        hello = {
+            "revision": 0,
+            "snapshot": None,
+            "encodings": list(SUPPORTED_ENCODINGS),
+            "compressions": list(AVAILABLE_COMPRESSIONS),
+            "ciphers": list(SUPPORTED_CIPHERS),
+            "nonce": self.nonce.hex(),
+            "acks": True,
+            "heartbeats": True
+        }
+        self.send(self.fernet.encrypt(json.dumps(hello).encode()), MESSAGE_TYPE_HELLO)
+        await self.writer.drain()
+
+    def send(self, payload, message_type):
+        frame = encode_frame(payload, message_type)
+        self.bytes_out += len(frame)
+        self.writer.write(frame)
+
+    def handle_welcome(self, payload):
+        welcome = json.loads(self.fernet.decrypt(payload))
+        server_nonce = bytes.fromhex(welcome["nonce"])
+        self.session_cipher = SessionCipher(welcome["cipher"], self.fernet_key, self.nonce, server_nonce)
+        self.ack_cipher = SessionCipher(welcome["cipher"], self.fernet_key, self.nonce, server_nonce, DIRECTION_TO_SERVER)
+
+    def handle_data(self, frame):
+        if self.session_cipher is not None:
+            payload = self.session_cipher.decrypt(frame.payload, frame.message_type, frame.flags)
+        else:
+            payload = self.fernet.decrypt(frame.payload)
+        message = decode_message(decompress(payload, frame.flags), ENCODING_COMPACT if frame.flags & FLAG_COMPACT else ENCODING_JSON)
+
+        self.messages += 1
+        if message.get("action") in COMPLETING_ACTIONS:
+            self.completed += 1
+            self.completed_at = time.perf_counter()
+
+        if "id" in message:
+            ack = json.dumps({"id": message["id"], "rows": 0, "apply_ms": 0, "error": None}).encode()
+            if self.ack_cipher is not None:
+                self.send(self.ack_cipher.encrypt(ack, MESSAGE_TYPE_ACK, 0), MESSAGE_TYPE_ACK)
+            else:
+                self.send(self.fernet.encrypt(ack), MESSAGE_TYPE_ACK)
+
+    async def listen(self):
+        try:
+            while True:
+                frame = await read_frame_async(self.reader)
+                if frame is None:
+                    break
+                self.bytes_in += HEADER.size + len(frame.payload)
+
+                if frame.message_type == MESSAGE_TYPE_PING:
+                    self.send(b"", MESSAGE_TYPE_PONG)
+                elif frame.message_type == MESSAGE_TYPE_WELCOME:
+                    self.handle_welcome(frame.payload)
+                elif frame.message_type == MESSAGE_TYPE_DATA:
+                    self.handle_data(frame)
+        except (ConnectionError, ProtocolError) as e:
+            self.error = str(e) or type(e).__name__
+        finally:
+            self.writer.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def raise_open_file_limit(clients):
+    # Every simulated client needs a socket here and another one in the server process, which inherits this limit.
+    try:
+        import resource
+    except ImportError:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+
+def process_tree(pid):
+    # The server and, with SERVER_WORKERS, its worker processes.
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+def server_memory(pid):
+    # Resident and peak resident set size in MB summed over the server's processes, read from /proc;
+    # None where that isn't available.
+    rss = peak = 0
+    for process_id in process_tree(pid):
+        try:
+            with open(f"/proc/{process_id}/status") as f:
+                fields = dict(line.split(":", 1) for line in f)
+        except OSError:
+            return None, None
+        rss += int(fields["VmRSS"].split()[0]) / 1024
+        peak += int(fields["VmHWM"].split()[0]) / 1024
+    return rss, peak
+
+def seed_personnel(count):
+    import server
+
+    server.Base.metadata.create_all(server.engine)
+    ssns = [f"{i // 1000000 % 1000:03d}-{i // 10000 % 100:02d}-{i % 10000:04d}" for i in range(count)]
+
+    # One change per person gives the roster a revision, so clients are synced from the change log like in production.
+    with server.session_scope() as session:
+        session.add_all(server.Personnel(name=f"Name{i}", surname=f"Surname{i}", ssn=ssn) for i, ssn in enumerate(ssns))
+        session.add_all(
+            server.PersonnelChange(ssn=ssn, operation="UPSERT", name=f"Name{i}", surname=f"Surname{i}")
+            for i, ssn in enumerate(ssns)
+        )
+
+    server.engine.dispose()
+    return ssns
+
+def start_server(directory, control_port, log_path):
+    environment = dict(
+        os.environ, CONTROL_ENABLED="true", CONTROL_HOST="127.0.0.1", CONTROL_PORT=str(control_port), CONTROL_TOKEN=CONTROL_TOKEN
+    )
+    log = open(log_path, "w")
+
+    # The menu blocks on stdin until the benchmark writes the exit choice.
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT], cwd=directory, env=environment,
+        stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT, text=True
+    )
+    log.close()
+    return process
+
+def wait_for_control_api(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode}")
+        try:
+            return call("GET", "/stats", None, url, CONTROL_TOKEN)
+        except URLError:
+            time.sleep(0.1)
+
+    raise SystemExit("Server did not start in time")
+
+def stop_server(process):
+    try:
+        process.communicate("7\n", timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def expected_completions(path, result):
+    if path == "/sync":
+        return sum(report["delivered"] for report in result["reports"])
+    if path in ("/send", "/delete", "/delete-all"):
+        return result["delivered"]
+    return 0
+
+async def connect_clients(clients, host, port, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    listeners = []
+
+    async def connect(client):
+        async with semaphore:
+            await client.connect(host, port)
+        listeners.append(asyncio.create_task(client.listen()))
+
+    await asyncio.gather(*(connect(client) for client in clients))
+    return listeners
+
+async def wait_for_registrations(url, count, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        rows = await loop.run_in_executor(None, call, "GET", "/table", {"table": "clients"}, url, CONTROL_TOKEN)
+        if len(rows) >= count:
+            return rows
+        await asyncio.sleep(0.05)
+
+    raise SystemExit(f"Only {len(rows)} of {count} clients registered within {timeout}s")
+
+async def run_operation(url, clients, method, path, params, timeout):
+    loop = asyncio.get_running_loop()
+    before = [(client.completed, client.messages, client.bytes_in) for client in clients]
+
+    start = time.perf_counter()
+    result = await loop.run_in_executor(None, call, method, path, params, url, CONTROL_TOKEN)
+    request_time = time.perf_counter() - start
+    expected = expected_completions(path, result)
+
+    # Fan-out latency runs from the request until each recipient has received the operation's last message.
+    deadline = time.monotonic() + timeout
+    while sum(client.completed - done for client, (done, _, _) in zip(clients, before)) < expected:
+        if time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.001)
+
+    latencies = [
+        (client.completed_at - start) * 1000
+        for client, (done, _, _) in zip(clients, before)
+        if client.completed > done
+    ]
+    return {
+        "request_ms": request_time * 1000,
+        "latencies": latencies,
+        "expected": expected,
+        "elapsed": max([request_time] + [latency / 1000 for latency in latencies]),
+        "messages": sum(client.messages - messages for client, (_, messages, _) in zip(clients, before)),
+        "bytes": sum(client.bytes_in - bytes_in for client, (_, _, bytes_in) in zip(clients, before)),
+    }
+
+async def run_benchmark(args, fernet_key, server_port, control_url, server_pid, ssns):
+    clients = [SimulatedClient(fernet_key) for _ in range(args.clients)]
+
+    start = time.perf_counter()
+    listeners = await connect_clients(clients, "127.0.0.1", server_port, args.connect_concurrency)
+    rows = await wait_for_registrations(control_url, args.clients, args.timeout)
+    connect_time = time.perf_counter() - start
+
+    rss, _ = server_memory(server_pid)
+    print(f"Connected {args.clients} clients in {connect_time:.2f} s ({args.clients / connect_time:,.0f} connects/s)")
+    if rss is not None:
+        print(f"Server RSS after connecting: {rss:.1f} MB")
+
+    # The "specific client" operations always target the same simulated client.
+    target = next(row for row in rows if row["port"] == clients[0].port)["name"]
+
+    operations = [
+        ("Display clients table", "GET", "/table", lambda ssn: {"table": "clients"}),
+        ("Send personnel to one client", "POST", "/send", lambda ssn: {"ssns": [ssn], "clients": [target]}),
+        ("Send personnel to all clients", "POST", "/send", lambda ssn: {"ssns": [ssn]}),
+        ("Send all personnel to all", "POST", "/sync", lambda ssn: None),
+        ("Delete personnel from one client", "POST", "/delete", lambda ssn: {"ssns": [ssn], "clients": [target]}),
+        ("Delete personnel from all clients", "POST", "/delete", lambda ssn: {"ssns": [ssn]}),
+        ("Delete all personnel from all", "POST", "/delete-all", lambda ssn: None),
+    ]
+    results = {name: [] for name, _, _, _ in operations}
+
+    for round_number in range(args.rounds):
+        ssn = ssns[round_number % len(ssns)]
+        for name, method, path, params in operations:
+            results[name].append(await run_operation(control_url, clients, method, path, params(ssn), args.timeout))
+
+    print()
+    print(
+        f"{'Operation':34} {'recipients':>10} {'request':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+        f"{'msgs/s':>9} {'MB in':>8}"
+    )
+    for name, runs in results.items():
+        latencies = [latency for run in runs for latency in run["latencies"]]
+        received = len(latencies)
+        expected = sum(run["expected"] for run in runs)
+        elapsed = sum(run["elapsed"] for run in runs)
+        messages = sum(run["messages"] for run in runs)
+
+        fields = [percentile(latencies, fraction) for fraction in (0.50, 0.95, 0.99, 1.0)]
+        print(
+            f"{name:34} {f'{received}/{expected}':>10} {sum(run['request_ms'] for run in runs) / len(runs):8.1f}ms "
+            + " ".join(f"{value:8.1f}" if value is not None else f"{'-':>8}" for value in fields)
+            + f" {messages / elapsed:9,.0f} {sum(run['bytes'] for run in runs) / 1024 / 1024:8.2f}"
+        )
+
+    print()
+    print(f"Bytes on wire: {sum(c.bytes_in for c in clients) / 1024 / 1024:.2f} MB to clients, {sum(c.bytes_out for c in clients) / 1024 / 1024:.2f} MB from clients")
+    rss, peak = server_memory(server_pid)
+    if rss is not None:
+        print(f"Server RSS: {rss:.1f} MB, peak {peak:.1f} MB")
+
+    errors = [client.error for client in clients if client.error]
+    if errors:
+        print(f"{len(errors)} clients disconnected with errors, first: {errors[0]}")
+
+    for client in clients:
+        client.writer.close()
+    await asyncio.gather(*listeners)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the server against SQLite and drive every menu operation with a fleet of simulated clients.")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--personnel", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3, help="times each operation is run")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="connections opened at the same time")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for registrations and deliveries")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--server-log", default=os.devnull, help="file for the server's output")
+    args = parser.parse_args()
+
+    raise_open_file_limit(args.clients)
+    server_log = os.path.abspath(args.server_log)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server_port = free_port()
+        control_port = free_port()
+        prepare_server_environment(directory, args.database_url or sqlite_database_url(directory), server_port)
+        ssns = seed_personnel(args.personnel)
+
+        with open(os.path.join(directory, "fernet_key.key"), "rb") as f:
+            fernet_key = f.read()
+
+        control_url = f"http://127.0.0.1:{control_port}"
+        process = start_server(directory, control_port, server_log)
+        try:
+            wait_for_control_api(control_url, process)
+            print(f"Server on port {server_port}, {args.personnel} personnel, {args.clients} clients, {args.rounds} rounds")
+            asyncio.run(run_benchmark(args, fernet_key, server_port, control_url, process.pid, ssns))
+        finally:
+            stop_server(process)
+            os.chdir(os.path.dirname(directory))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from benchmarks.environment import prepare_server_environment, sqlite_database_url
+
+def legacy_register_client(server, client_host, client_port):
+    # Registration as it worked before the in-memory name sequence: probe for a free id, then insert.
+    session = server.Session()
+
+    try:
+        max_id = session.query(func.max(server.Client.id)).scalar()
+        next_id = 1 if max_id is None else max_id + 1
+        while session.query(server.Client).filter_by(id=next_id).first() is not None:
+            next_id += 1
+
+        new_client = server.Client(name=f"Client #{next_id}", host=client_host, port=client_port)
+        session.add(new_client)
+        session.commit()
+        return new_client.id, new_client.name
+    except SQLAlchemyError:
+        session.rollback()
+        return None
+    finally:
+        session.close()
+
+def run(register, server, threads, clients_per_thread, first_port):
+    failures = []
+
+    def register_many(thread_number):
+        for i in range(clients_per_thread):
+            port = first_port + thread_number * clients_per_thread + i
+            if register(server, "127.0.0.1", port) is None:
+                failures.append(port)
+
+    workers = [threading.Thread(target=register_many, args=(n,)) for n in range(threads)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    return threads * clients_per_thread / elapsed, len(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent client registrations per second.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=250, help="registrations per thread")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_server_environment(directory, args.database_url or sqlite_database_url(directory))
+
+        import server
+        server.Base.metadata.create_all(server.engine)
+
+        def new_register_client(server, client_host, client_port):
+            return server.register_client(client_host, client_port)
+
+        total = args.threads * args.clients
+        rate, failures = run(legacy_register_client, server, args.threads, args.clients, 10000)
+        print(f"Probe loop:         {rate:,.0f} registrations/s, {failures} of {total} failed (duplicate names)")
+
+        rate, failures = run(new_register_client, server, args.threads, args.clients, 10000 + total)
+        print(f"In-memory sequence: {rate:,.0f} registrations/s, {failures} of {total} failed")
+
+        os.chdir(os.path.dirname(directory))
+        server.engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.encrypt_once import build_save_all_message
+from protocol import MESSAGE_TYPE_DATA
+from session_cipher import SUPPORTED_CIPHERS, SessionCipher, new_handshake_nonce
+
+def measure_fernet(fernet, payload, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        token = fernet.encrypt(payload)
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(count):
+        fernet.decrypt(token)
+    decrypt_time = time.perf_counter() - start
+
+    return encrypt_time, decrypt_time, len(token)
+
+def measure_session(sender, receiver, payload, count):
+    # The receiver rejects a frame it has already seen, so every token is kept and decrypted once, in order.
+    start = time.perf_counter()
+    tokens = [sender.encrypt(payload, MESSAGE_TYPE_DATA, 0) for _ in range(count)]
+    encrypt_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for token in tokens:
+        receiver.decrypt(token, MESSAGE_TYPE_DATA, 0)
+    decrypt_time = time.perf_counter() - start
+
+    return encrypt_time, decrypt_time, len(tokens[-1])
+
+def report(label, payload, count, result):
+    encrypt_time, decrypt_time, token_size = result
+    print(
+        f"  {label:18} {count / encrypt_time:10,.0f} encrypts/s {count / decrypt_time:10,.0f} decrypts/s "
+        f"{len(payload) * count / encrypt_time / 1024 / 1024:8.1f} MB/s, {token_size - len(payload):+,} bytes per message"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Fernet with the session AEAD ciphers for small and large messages.")
+    parser.add_argument("--small-count", type=int, default=100000)
+    parser.add_argument("--large-personnel", type=int, default=10000)
+    parser.add_argument("--large-count", type=int, default=50)
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    fernet = Fernet(key)
+
+    small = json.dumps({"action": "DELETE", "personnel": {"ssn": "123-45-6789"}}).encode()
+    large = build_save_all_message(args.large_personnel).encode()
+
+    for label, payload, count in (("Small DELETE", small, args.small_count), ("Large SAVE_ALL", large, args.large_count)):
+        print(f"{label}: {len(payload):,} bytes x {count:,}")
+        report("fernet", payload, count, measure_fernet(fernet, payload, count))
+
+        for name in SUPPORTED_CIPHERS:
+            client_nonce, server_nonce = new_handshake_nonce(), new_handshake_nonce()
+            sender = SessionCipher(name, key, client_nonce, server_nonce)
+            receiver = SessionCipher(name, key, client_nonce, server_nonce)
+            report(name, payload, count, measure_session(sender, receiver, payload, count))
+
+if __name__ == "__main__":
+    main()
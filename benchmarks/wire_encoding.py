@@ -0,0 +1,44 @@
+import argparse
+import json
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.encrypt_once import build_save_all_message
+from codec import ENCODING_COMPACT, ENCODING_JSON, decode_message, encode_message
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bytes on the wire and encode/decode time of the JSON and compact encodings.")
+    parser.add_argument("--personnel", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fernet = Fernet(Fernet.generate_key())
+    message = json.loads(build_save_all_message(args.personnel))
+    message["replace"] = True
+    message["revision"] = 1
+
+    print(f"SAVE_ALL with {args.personnel} personnel, best of {args.repeat}")
+
+    for encoding in (ENCODING_JSON, ENCODING_COMPACT):
+        encode_time, payload = best_of(args.repeat, encode_message, message, encoding)
+        decode_time, decoded = best_of(args.repeat, decode_message, payload, encoding)
+        assert decoded["personnel"] == message["personnel"]
+
+        token = fernet.encrypt(payload)
+        print(
+            f"{encoding:8} {len(payload) / 1024 / 1024:7.2f} MB encoded, {len(token) / 1024 / 1024:7.2f} MB encrypted, "
+            f"encode {encode_time * 1000:8.1f} ms, decode {decode_time * 1000:8.1f} ms"
+        )
+
+if __name__ == "__main__":
+    main()
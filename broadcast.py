@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+from codec import ENCODING_JSON
+from protocol import write_encoded_frame_async
+
+class DeliveryError(Exception):
+    pass
+
+class ClientConnection:
+    def __init__(self, host, port, writer, queue_size, send_timeout):
+        self.host = host
+        self.port = port
+        self.writer = writer
+        self.client_id = None
+        self.client_name = None
+        self.sync_revision = None
+        self.snapshot_progress = None
+        self.encoding = ENCODING_JSON
+        self.compression = None
+        self.session_cipher = None
+        self.receive_cipher = None
+        self.acks = False
+        self.last_seen = time.monotonic()
+        self.send_timeout = send_timeout
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.sender_task = None
+        self.closed = False
+
+    def __repr__(self):
+        return f"<ClientConnection({self.host}:{self.port}, queued={self.queue.qsize()})>"
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    @property
+    def wire_format(self):
+        return (self.encoding, self.compression)
+
+    @property
+    def frame_key(self):
+        # Connections with their own session key can't share an encrypted frame with anyone.
+        if self.session_cipher is not None:
+            return self.address
+        return self.wire_format
+
+    def start(self):
+        self.sender_task = asyncio.create_task(self._send_queued_frames())
+
+    def enqueue(self, frame):
+        future = asyncio.get_running_loop().create_future()
+
+        if self.closed:
+            future.set_exception(DeliveryError("connection closed"))
+        else:
+            try:
+                self.queue.put_nowait((frame, future, time.perf_counter()))
+            except asyncio.QueueFull:
+                future.set_exception(DeliveryError("outbound queue full"))
+
+        return future
+
+    def post(self, frame):
+        # Fire-and-forget send for control frames; a failed write already closes the connection.
+        future = self.enqueue(frame)
+        future.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    async def _send_queued_frames(self):
+        while True:
+            frame, future, queued_at = await self.queue.get()
+
+            try:
+                await asyncio.wait_for(write_encoded_frame_async(self.writer, frame), self.send_timeout)
+            except asyncio.CancelledError:
+                future.set_exception(DeliveryError("connection closed"))
+                raise
+            except asyncio.TimeoutError:
+                # The peer stopped reading; dropping it keeps its backlog from growing without bound.
+                future.set_exception(DeliveryError(f"send timed out after {self.send_timeout}s"))
+                self.close(abort=True)
+                return
+            except Exception as e:
+                future.set_exception(DeliveryError(str(e) or type(e).__name__))
+                self.close(abort=True)
+                return
+
+            future.set_result(time.perf_counter() - queued_at)
+
+    def close(self, abort=False):
+        if self.closed:
+            return
+
+        self.closed = True
+        if abort:
+            # Don't wait for a stalled peer to drain what is already buffered.
+            self.writer.transport.abort()
+        else:
+            self.writer.close()
+
+        if self.sender_task is not None and self.sender_task is not asyncio.current_task():
+            self.sender_task.cancel()
+
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(DeliveryError("connection closed"))
+
+class BroadcastReport:
+    def __init__(self):
+        self.delivered = []
+        self.slow = []
+        self.failed = {}
+
+    def __repr__(self):
+        return f"<BroadcastReport(delivered={len(self.delivered)}, slow={len(self.slow)}, failed={len(self.failed)})>"
+
+    def summary(self):
+        lines = [f"Delivered: {len(self.delivered)}, slow: {len(self.slow)}, failed: {len(self.failed)}"]
+
+        for host, port in self.slow:
+            lines.append(f"  Slow client {host}:{port}")
+        for (host, port), reason in self.failed.items():
+            lines.append(f"  Failed client {host}:{port}: {reason}")
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "delivered": len(self.delivered),
+            "slow": [f"{host}:{port}" for host, port in self.slow],
+            "failed": {f"{host}:{port}": reason for (host, port), reason in self.failed.items()},
+        }
+
+def merge_reports(reports):
+    merged = BroadcastReport()
+
+    for report in reports:
+        merged.delivered.extend(report.delivered)
+        merged.slow.extend(report.slow)
+        merged.failed.update(report.failed)
+
+    return merged
+
+async def broadcast(connections, frames, slow_threshold, missing=None, on_sent=None):
+    report = BroadcastReport()
+
+    # missing maps the addresses of recipients that were never queued to the reason why.
+    report.failed.update(missing or {})
+
+    # frames holds one encoded frame per frame key; recipients with the same key share it without copies.
+    frames = {frame_key: memoryview(frame) for frame_key, frame in frames.items()}
+    pending = [(connection.address, connection.frame_key, connection.enqueue(frames[connection.frame_key])) for connection in connections]
+
+    for address, frame_key, future in pending:
+        try:
+            elapsed = await future
+        except DeliveryError as e:
+            report.failed[address] = str(e)
+            continue
+
+        # on_sent(seconds, size) is called for every frame written, with the time it spent queued and being written.
+        if on_sent is not None:
+            on_sent(elapsed, len(frames[frame_key]))
+
+        if elapsed > slow_threshold:
+            report.slow.append(address)
+        report.delivered.append(address)
+
+    return report
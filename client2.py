@@ -1,10 +1,16 @@
+import random
 import socket
-import threading
-import os
 import sqlite3
+import time
+import os
 import json
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
+from client_store import PersonnelStore
+from codec import ENCODING_COMPACT, ENCODING_JSON, SUPPORTED_ENCODINGS, decode_message
+from compression import AVAILABLE_COMPRESSIONS, decompress
+from protocol import FLAG_COMPACT, MESSAGE_TYPE_ACK, MESSAGE_TYPE_DATA, MESSAGE_TYPE_HELLO, MESSAGE_TYPE_PING, MESSAGE_TYPE_PONG, MESSAGE_TYPE_WELCOME, FrameReader, send_frame
+from session_cipher import DIRECTION_TO_SERVER, SUPPORTED_CIPHERS, SessionCipher, new_handshake_nonce
 
 load_dotenv(override=True)
 
@@ -17,77 +23,170 @@ CLIENT_DATABASE_FILE = "client_two_database.db"
 
 SERVER_HOST = os.getenv("SERVER_HOST")
 SERVER_PORT = int(os.getenv("SERVER_PORT"))
+RECONNECT_MIN_DELAY = float(os.getenv("RECONNECT_MIN_DELAY", "1"))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", "30"))
+
+def apply_message(store, message_dict):
+    action = message_dict.get("action")
+    personnel = message_dict.get("personnel")
+
+    if action == "SAVE":
+        rows = store.save_personnel([personnel])
+        print(f"Personnel {personnel.get('name')} {personnel.get('surname')} saved successfully.")
+    elif action == "DELETE":
+        rows = store.delete_personnel([personnel.get("ssn")])
+        print("Personnel deleted successfully.")
+    elif action == "SAVE_ALL":
+        rows = store.save_personnel(personnel, message_dict.get("replace", False), message_dict.get("revision"))
+        print(f"{len(personnel)} personnel saved successfully.")
+    elif action == "SNAPSHOT_BEGIN":
+        store.begin_snapshot(message_dict["snapshot_id"], message_dict["revision"])
+        rows = 0
+    elif action == "SNAPSHOT_CHUNK":
+        applied = store.apply_snapshot_chunk(message_dict["snapshot_id"], message_dict["seq"], message_dict["last_id"], personnel)
+        rows = len(personnel) if applied else 0
+    elif action == "SNAPSHOT_END":
+        rows = 0
+        if store.finish_snapshot(message_dict["snapshot_id"], message_dict["revision"]):
+            print(f"Snapshot at revision {message_dict['revision']} applied.")
+    elif action == "SYNC":
+        rows = store.apply_sync(message_dict["deletes"], message_dict["upserts"], message_dict["revision"])
+        print(f"Synced to revision {message_dict['revision']}.")
+    elif action == "DELETE_ALL":
+        rows = store.delete_all_personnel()
+        print("All Personnel deleted successfully.")
+    else:
+        raise ValueError(f"Unknown action {action}")
+
+    return rows
+
+def send_ack(client_socket, ack_cipher, ack):
+    payload = json.dumps(ack).encode()
+
+    if ack_cipher is not None:
+        send_frame(client_socket, ack_cipher.encrypt(payload, MESSAGE_TYPE_ACK, 0), MESSAGE_TYPE_ACK)
+    else:
+        send_frame(client_socket, cipher.encrypt(payload), MESSAGE_TYPE_ACK)
+
+def listen_to_server(client_socket, store, client_nonce):
+    # Returns whether the server registered the session, i.e. sent a heartbeat or a message.
+    reader = FrameReader(client_socket)
+    session_cipher = None
+    ack_cipher = None
+    registered = False
 
-def listen_to_server(client_socket):
     try:
         while True:
-            encrypted_message = client_socket.recv(1024)
-            if not encrypted_message:
+            frame = reader.read_frame()
+            if frame is None:
                 print('Disconnected from server')
                 break
 
-            decrypted_message = cipher.decrypt(encrypted_message)
-            decrypted_message_str = decrypted_message.decode()
-            message_dict = json.loads(decrypted_message_str)
-
-            action = message_dict.get("action")
-            personnel = message_dict.get("personnel")
-
-            if action == "SAVE":
-                save_personnel(personnel)
-            elif action == "DELETE":
-                delete_personnel(personnel)
-                print("Personnel deleted successfully.")
-            elif action == "SAVE_ALL":
-                for personnel in message_dict["personnel"]:
-                    save_personnel(personnel)
-            elif action == "DELETE_ALL":
-                conn = sqlite3.connect(CLIENT_DATABASE_FILE)
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM personnel")
-                conn.commit()
-                conn.close()     
-                print("All Personnel deleted successfully.")           
+            if frame.message_type == MESSAGE_TYPE_PING:
+                registered = True
+                send_frame(client_socket, b"", MESSAGE_TYPE_PONG)
+                continue
+
+            if frame.message_type == MESSAGE_TYPE_WELCOME:
+                welcome = json.loads(cipher.decrypt(frame.payload))
+                server_nonce = bytes.fromhex(welcome["nonce"])
+                session_cipher = SessionCipher(welcome["cipher"], fernet_key, client_nonce, server_nonce)
+                ack_cipher = SessionCipher(welcome["cipher"], fernet_key, client_nonce, server_nonce, DIRECTION_TO_SERVER)
+                print(f"Using {welcome['cipher']} session encryption.")
+                continue
+
+            if frame.message_type != MESSAGE_TYPE_DATA:
+                print(f"Ignoring frame of unknown type {frame.message_type}")
+                continue
+
+            if session_cipher is not None:
+                decrypted_message = session_cipher.decrypt(frame.payload, frame.message_type, frame.flags)
             else:
-                print("Unknown action received from server.")
+                decrypted_message = cipher.decrypt(frame.payload)
+            decrypted_message = decompress(decrypted_message, frame.flags)
+            encoding = ENCODING_COMPACT if frame.flags & FLAG_COMPACT else ENCODING_JSON
+            message_dict = decode_message(decrypted_message, encoding)
+            registered = True
+
+            start = time.perf_counter()
+            error = None
+            rows = 0
+            try:
+                rows = apply_message(store, message_dict)
+            except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+                # A message that can't be applied is reported to the server instead of ending the session.
+                error = str(e) or type(e).__name__
+                print(f"Error applying {message_dict.get('action')} message: {error}")
+
+            if "id" in message_dict:
+                # The last applied id is reported on reconnect, so the server replays only what came after it.
+                if error is None:
+                    store.record_message(message_dict["id"])
+
+                ack = {
+                    "id": message_dict["id"],
+                    "rows": rows,
+                    "apply_ms": round((time.perf_counter() - start) * 1000, 3),
+                    "error": error
+                }
+                send_ack(client_socket, ack_cipher, ack)
 
     except Exception as e:
         print("Error:", e)
     finally:
         client_socket.close()
 
-def save_personnel(personnel):
-    name = personnel.get("name")
-    surname = personnel.get("surname")
-    ssn = personnel.get("ssn")
+    return registered
 
-    conn = sqlite3.connect(CLIENT_DATABASE_FILE)
-    cursor = conn.cursor()
+def send_hello(client_socket, store):
+    client_nonce = new_handshake_nonce()
 
-    cursor.execute("INSERT INTO personnel (NAME, SURNAME, SSN) VALUES (?, ?, ?)", (name, surname, ssn))
-    conn.commit()
-    print(f"Personnel {name} {surname} saved successfully.")
+    hello = {
+        "revision": store.get_sync_revision(),
+        "snapshot": store.get_snapshot_progress(),
+        "uid": store.get_client_uid(),
+        "last_message_id": store.get_last_message_id(),
+        "encodings": list(SUPPORTED_ENCODINGS),
+        "compressions": list(AVAILABLE_COMPRESSIONS),
+        "ciphers": list(SUPPORTED_CIPHERS),
+        "nonce": client_nonce.hex(),
+        "acks": True,
+        "heartbeats": True
+    }
+    send_frame(client_socket, cipher.encrypt(json.dumps(hello).encode()), MESSAGE_TYPE_HELLO)
 
-def delete_personnel(personnel):
-    ssn = personnel.get("ssn")
-
-    conn = sqlite3.connect(CLIENT_DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM personnel WHERE SSN = ?", (ssn,))
-    conn.commit()
+    return client_nonce
 
 def main():
-    try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    store = PersonnelStore(CLIENT_DATABASE_FILE)
+    delay = RECONNECT_MIN_DELAY
 
-        client_socket.connect((SERVER_HOST, SERVER_PORT))
-        print(f"Connected to server {SERVER_HOST}:{SERVER_PORT}")
-
-        listen_thread = threading.Thread(target=listen_to_server, args=(client_socket,))
-        listen_thread.start()
+    try:
+        while True:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+            try:
+                client_socket.connect((SERVER_HOST, SERVER_PORT))
+                print(f"Connected to server {SERVER_HOST}:{SERVER_PORT}")
+
+                client_nonce = send_hello(client_socket, store)
+                # A server that accepts connections but drops them before registering them doesn't reset the backoff.
+                if listen_to_server(client_socket, store, client_nonce):
+                    delay = RECONNECT_MIN_DELAY
+            except OSError as e:
+                print(f"Could not connect to server {SERVER_HOST}:{SERVER_PORT}: {e}")
+                client_socket.close()
+
+            # Backing off with jitter keeps a fleet of clients from reconnecting in lockstep after a server restart.
+            wait = random.uniform(delay / 2, delay)
+            print(f"Reconnecting in {wait:.1f}s")
+            time.sleep(wait)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
 
     except KeyboardInterrupt:
         print("Client shutting down")
+    finally:
+        store.close()
 
 if __name__ == "__main__":
     main()
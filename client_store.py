@@ -0,0 +1,183 @@
+import sqlite3
+import uuid
+
+class PersonnelStore:
+    def __init__(self, database_file):
+        # One connection for the life of the client, used only by the thread that connects and listens to the server.
+        self.conn = sqlite3.connect(database_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def close(self):
+        self.conn.close()
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS personnel (
+                ID INTEGER PRIMARY KEY,
+                NAME TEXT,
+                SURNAME TEXT,
+                SSN TEXT
+            )
+            ''')
+
+            self._create_ssn_index()
+
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                ID INTEGER PRIMARY KEY CHECK (ID = 1),
+                REVISION INTEGER NOT NULL
+            )
+            ''')
+
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_state (
+                ID INTEGER PRIMARY KEY CHECK (ID = 1),
+                SNAPSHOT_ID TEXT NOT NULL,
+                REVISION INTEGER NOT NULL,
+                SEQ INTEGER NOT NULL,
+                LAST_ID INTEGER NOT NULL
+            )
+            ''')
+
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS client_state (
+                ID INTEGER PRIMARY KEY CHECK (ID = 1),
+                UID TEXT NOT NULL,
+                LAST_MESSAGE_ID INTEGER
+            )
+            ''')
+
+    def _create_ssn_index(self):
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'personnel_ssn'"
+        ).fetchone()
+        if exists:
+            return
+
+        # Databases created before the index may hold duplicate SSNs; keep the newest row of each.
+        self.conn.execute('''
+        DELETE FROM personnel
+        WHERE SSN IS NOT NULL AND ID NOT IN (SELECT MAX(ID) FROM personnel WHERE SSN IS NOT NULL GROUP BY SSN)
+        ''')
+        self.conn.execute("CREATE UNIQUE INDEX personnel_ssn ON personnel (SSN)")
+
+    def _insert_personnel(self, personnel_list):
+        return self.conn.executemany(
+            "INSERT INTO personnel (NAME, SURNAME, SSN) VALUES (?, ?, ?) "
+            "ON CONFLICT (SSN) DO UPDATE SET NAME = excluded.NAME, SURNAME = excluded.SURNAME",
+            [(personnel.get("name"), personnel.get("surname"), personnel.get("ssn")) for personnel in personnel_list]
+        ).rowcount
+
+    def _delete_personnel(self, ssns):
+        return self.conn.executemany("DELETE FROM personnel WHERE SSN = ?", [(ssn,) for ssn in ssns]).rowcount
+
+    def _set_sync_revision(self, revision):
+        self.conn.execute("INSERT OR REPLACE INTO sync_state (ID, REVISION) VALUES (1, ?)", (revision,))
+
+    def _forget_sync_state(self):
+        # A targeted SAVE or DELETE leaves the roster at no known revision, so the next sync sends a full snapshot.
+        self.conn.execute("DELETE FROM sync_state")
+        self.conn.execute("DELETE FROM snapshot_state")
+
+    def _set_snapshot_progress(self, snapshot_id, revision, seq, last_id):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO snapshot_state (ID, SNAPSHOT_ID, REVISION, SEQ, LAST_ID) VALUES (1, ?, ?, ?, ?)",
+            (snapshot_id, revision, seq, last_id)
+        )
+
+    def save_personnel(self, personnel_list, replace=False, revision=None):
+        with self.conn:
+            if replace:
+                self.conn.execute("DELETE FROM personnel")
+            rows = self._insert_personnel(personnel_list)
+            if revision is not None:
+                self._set_sync_revision(revision)
+            else:
+                self._forget_sync_state()
+        return rows
+
+    def delete_personnel(self, ssns):
+        with self.conn:
+            rows = self._delete_personnel(ssns)
+            self._forget_sync_state()
+        return rows
+
+    def delete_all_personnel(self):
+        with self.conn:
+            rows = self.conn.execute("DELETE FROM personnel").rowcount
+            self.conn.execute("DELETE FROM snapshot_state")
+            self._set_sync_revision(0)
+        return rows
+
+    def apply_sync(self, deletes, upserts, revision):
+        with self.conn:
+            rows = self._delete_personnel(deletes) + self._insert_personnel(upserts)
+            self._set_sync_revision(revision)
+        return rows
+
+    def get_sync_revision(self):
+        row = self.conn.execute("SELECT REVISION FROM sync_state WHERE ID = 1").fetchone()
+        return row[0] if row else 0
+
+    def get_snapshot_progress(self):
+        row = self.conn.execute("SELECT SNAPSHOT_ID, REVISION, SEQ, LAST_ID FROM snapshot_state WHERE ID = 1").fetchone()
+
+        if row is None:
+            return None
+        return {"snapshot_id": row[0], "revision": row[1], "seq": row[2], "last_id": row[3]}
+
+    def get_client_uid(self):
+        # The identity is created once and kept with the data, so the server recognizes this client after a reconnect.
+        row = self.conn.execute("SELECT UID FROM client_state WHERE ID = 1").fetchone()
+        if row is not None:
+            return row[0]
+
+        uid = uuid.uuid4().hex
+        with self.conn:
+            self.conn.execute("INSERT INTO client_state (ID, UID) VALUES (1, ?)", (uid,))
+        return uid
+
+    def get_last_message_id(self):
+        row = self.conn.execute("SELECT LAST_MESSAGE_ID FROM client_state WHERE ID = 1").fetchone()
+        return (row[0] if row else None) or 0
+
+    def record_message(self, message_id):
+        self.get_client_uid()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE client_state SET LAST_MESSAGE_ID = MAX(COALESCE(LAST_MESSAGE_ID, 0), ?) WHERE ID = 1", (message_id,)
+            )
+
+    def begin_snapshot(self, snapshot_id, revision):
+        progress = self.get_snapshot_progress()
+        if progress is not None and progress["snapshot_id"] == snapshot_id:
+            return False
+
+        with self.conn:
+            self.conn.execute("DELETE FROM personnel")
+            self._set_snapshot_progress(snapshot_id, revision, -1, 0)
+        return True
+
+    def apply_snapshot_chunk(self, snapshot_id, seq, last_id, personnel_list):
+        progress = self.get_snapshot_progress()
+        if progress is None or progress["snapshot_id"] != snapshot_id or seq <= progress["seq"]:
+            return False
+
+        # The chunk and the resume point are committed together, so a crash never skips or repeats rows.
+        with self.conn:
+            self._insert_personnel(personnel_list)
+            self._set_snapshot_progress(snapshot_id, progress["revision"], seq, last_id)
+        return True
+
+    def finish_snapshot(self, snapshot_id, revision):
+        progress = self.get_snapshot_progress()
+        if progress is None or progress["snapshot_id"] != snapshot_id:
+            return False
+
+        with self.conn:
+            self.conn.execute("DELETE FROM snapshot_state")
+            self._set_sync_revision(revision)
+        return True
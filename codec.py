@@ -0,0 +1,191 @@
+import json
+import struct
+
+ENCODING_JSON = "json"
+ENCODING_COMPACT = "compact"
+
+# In order of preference; the server picks the first one the client also offers.
+SUPPORTED_ENCODINGS = (ENCODING_COMPACT, ENCODING_JSON)
+
+COUNT = struct.Struct("!I")
+INTEGER = struct.Struct("!q")
+STRING_LENGTH = struct.Struct("!H")
+
+# Stands in for a missing integer, e.g. a SAVE_ALL without a revision.
+NO_INTEGER = -(2 ** 63)
+
+class CodecError(Exception):
+    pass
+
+def choose_encoding(offered):
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in (offered or ()):
+            return encoding
+    return ENCODING_JSON
+
+class IntegerField:
+    def encode(self, value, out):
+        out += INTEGER.pack(NO_INTEGER if value is None else value)
+
+    def decode(self, buffer, offset):
+        (value,) = INTEGER.unpack_from(buffer, offset)
+        return (None if value == NO_INTEGER else value), offset + INTEGER.size
+
+class BooleanField:
+    def encode(self, value, out):
+        out.append(1 if value else 0)
+
+    def decode(self, buffer, offset):
+        return bool(buffer[offset]), offset + 1
+
+class StringField:
+    def encode(self, value, out):
+        data = value.encode()
+        out += STRING_LENGTH.pack(len(data))
+        out += data
+
+    def decode(self, buffer, offset):
+        (length,) = STRING_LENGTH.unpack_from(buffer, offset)
+        offset += STRING_LENGTH.size
+        return bytes(buffer[offset:offset + length]).decode(), offset + length
+
+class StringListField:
+    # A count and one NUL-separated UTF-8 block, so a whole column is encoded and decoded in single calls.
+    def encode(self, values, out):
+        block = "\0".join(values)
+        if block.count("\0") != max(len(values) - 1, 0):
+            raise CodecError("Strings in a compact list must not contain NUL characters")
+
+        data = block.encode()
+        out += COUNT.pack(len(values))
+        out += COUNT.pack(len(data))
+        out += data
+
+    def decode(self, buffer, offset):
+        count, length = struct.unpack_from("!II", buffer, offset)
+        offset += 2 * COUNT.size
+
+        values = bytes(buffer[offset:offset + length]).decode().split("\0") if count else []
+        if len(values) != count:
+            raise CodecError(f"Expected {count} strings, found {len(values)}")
+        return values, offset + length
+
+class RecordField:
+    def __init__(self, keys):
+        self.keys = keys
+        self.string = StringField()
+
+    def encode(self, value, out):
+        for key in self.keys:
+            self.string.encode(value.get(key) or "", out)
+
+    def decode(self, buffer, offset):
+        record = {}
+        for key in self.keys:
+            record[key], offset = self.string.decode(buffer, offset)
+        return record, offset
+
+class RecordListField:
+    # Records are stored column by column, so no key is repeated per row.
+    def __init__(self, keys):
+        self.keys = keys
+        self.column = StringListField()
+
+    def encode(self, values, out):
+        for key in self.keys:
+            self.column.encode([value.get(key) or "" for value in values], out)
+
+    def decode(self, buffer, offset):
+        # Filling the records a column at a time is about twice as fast as building each one with dict(zip(...)).
+        records = None
+        for key in self.keys:
+            column, offset = self.column.decode(buffer, offset)
+            if records is None:
+                records = [{key: value} for value in column]
+                continue
+            if len(column) != len(records):
+                raise CodecError(f"Column {key} has {len(column)} values, expected {len(records)}")
+            for record, value in zip(records, column):
+                record[key] = value
+        return records, offset
+
+PERSONNEL_KEYS = ("name", "surname", "ssn")
+
+INTEGER_FIELD = IntegerField()
+BOOLEAN_FIELD = BooleanField()
+STRING_FIELD = StringField()
+PERSONNEL_FIELD = RecordField(PERSONNEL_KEYS)
+SSN_FIELD = RecordField(("ssn",))
+PERSONNEL_LIST_FIELD = RecordListField(PERSONNEL_KEYS)
+SSN_LIST_FIELD = StringListField()
+
+# action: (code, ((key, field), ...)); codes are part of the wire format and must never be reused.
+SCHEMAS = {
+    "SAVE": (1, (("personnel", PERSONNEL_FIELD),)),
+    "DELETE": (2, (("personnel", SSN_FIELD),)),
+    "SAVE_ALL": (3, (("replace", BOOLEAN_FIELD), ("revision", INTEGER_FIELD), ("personnel", PERSONNEL_LIST_FIELD))),
+    "DELETE_ALL": (4, ()),
+    "SYNC": (5, (
+        ("from_revision", INTEGER_FIELD),
+        ("revision", INTEGER_FIELD),
+        ("upserts", PERSONNEL_LIST_FIELD),
+        ("deletes", SSN_LIST_FIELD),
+    )),
+    "SNAPSHOT_BEGIN": (6, (("snapshot_id", STRING_FIELD), ("revision", INTEGER_FIELD))),
+    "SNAPSHOT_CHUNK": (7, (
+        ("snapshot_id", STRING_FIELD),
+        ("seq", INTEGER_FIELD),
+        ("last_id", INTEGER_FIELD),
+        ("personnel", PERSONNEL_LIST_FIELD),
+    )),
+    "SNAPSHOT_END": (8, (("snapshot_id", STRING_FIELD), ("revision", INTEGER_FIELD), ("chunks", INTEGER_FIELD))),
+}
+
+ACTIONS_BY_CODE = {code: (action, fields) for action, (code, fields) in SCHEMAS.items()}
+
+def encode_compact(message):
+    action = message.get("action")
+    if action not in SCHEMAS:
+        raise CodecError(f"No compact encoding for action {action}")
+
+    code, fields = SCHEMAS[action]
+    out = bytearray([code])
+    INTEGER_FIELD.encode(message.get("id"), out)
+    for key, field in fields:
+        field.encode(message.get(key), out)
+    return bytes(out)
+
+def decode_compact(payload):
+    buffer = memoryview(payload)
+    if not buffer:
+        raise CodecError("Empty compact message")
+
+    if buffer[0] not in ACTIONS_BY_CODE:
+        raise CodecError(f"Unknown compact action code {buffer[0]}")
+
+    action, fields = ACTIONS_BY_CODE[buffer[0]]
+    message = {"action": action}
+    offset = 1
+    try:
+        # Every message starts with its operation id; messages that are not acknowledged have none.
+        operation_id, offset = INTEGER_FIELD.decode(buffer, offset)
+        if operation_id is not None:
+            message["id"] = operation_id
+        for key, field in fields:
+            message[key], offset = field.decode(buffer, offset)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise CodecError(f"Malformed {action} message: {e}")
+
+    if offset != len(buffer):
+        raise CodecError(f"{len(buffer) - offset} trailing bytes after {action} message")
+    return message
+
+def encode_message(message, encoding):
+    if encoding == ENCODING_COMPACT:
+        return encode_compact(message)
+    return json.dumps(message).encode()
+
+def decode_message(payload, encoding):
+    if encoding == ENCODING_COMPACT:
+        return decode_compact(payload)
+    return json.loads(payload)
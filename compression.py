@@ -0,0 +1,110 @@
+import lzma
+import threading
+import time
+import zlib
+
+from protocol import FLAG_LZMA, FLAG_ZLIB, FLAG_ZSTD, MAX_PAYLOAD_SIZE, ProtocolError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+
+FLAGS = {
+    COMPRESSION_ZSTD: FLAG_ZSTD,
+    COMPRESSION_ZLIB: FLAG_ZLIB,
+    COMPRESSION_LZMA: FLAG_LZMA,
+}
+
+# zstd is only offered when the optional zstandard package is installed.
+AVAILABLE_COMPRESSIONS = tuple(
+    algorithm for algorithm in (COMPRESSION_ZSTD, COMPRESSION_ZLIB, COMPRESSION_LZMA)
+    if algorithm != COMPRESSION_ZSTD or zstandard is not None
+)
+
+def compress(data, algorithm):
+    if algorithm == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if algorithm == COMPRESSION_ZLIB:
+        return zlib.compress(data, 6)
+    if algorithm == COMPRESSION_LZMA:
+        return lzma.compress(data)
+    raise ValueError(f"Unknown compression {algorithm}")
+
+def decompress(data, flags, max_size=MAX_PAYLOAD_SIZE):
+    # Output is capped so a small malicious frame can't expand into gigabytes.
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise ProtocolError("Received a zstd frame but zstandard is not installed")
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            output = reader.read(max_size + 1)
+    elif flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        output = decompressor.decompress(data, max_size + 1)
+        if not decompressor.eof and len(output) <= max_size:
+            raise ProtocolError("Truncated zlib payload")
+    elif flags & FLAG_LZMA:
+        decompressor = lzma.LZMADecompressor()
+        output = decompressor.decompress(data, max_size + 1)
+        if not decompressor.eof and len(output) <= max_size:
+            raise ProtocolError("Truncated lzma payload")
+    else:
+        return data
+
+    if len(output) > max_size:
+        raise ProtocolError(f"Decompressed payload exceeds the {max_size} byte limit")
+    return output
+
+class Compressor:
+    def __init__(self, preference=AVAILABLE_COMPRESSIONS, threshold=1024):
+        self.preference = [algorithm for algorithm in preference if algorithm in AVAILABLE_COMPRESSIONS]
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.skipped = 0
+
+    def choose(self, offered):
+        for algorithm in self.preference:
+            if algorithm in (offered or ()):
+                return algorithm
+        return None
+
+    def compress(self, payload, algorithm):
+        # Returns the payload to send and the frame flag that marks it; small or incompressible payloads go as they are.
+        if algorithm is None or len(payload) < self.threshold:
+            return payload, 0
+
+        start = time.perf_counter()
+        compressed = compress(payload, algorithm)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            stats = self._stats.setdefault(algorithm, {"messages": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0})
+            stats["messages"] += 1
+            stats["bytes_in"] += len(payload)
+            stats["bytes_out"] += min(len(compressed), len(payload))
+            stats["seconds"] += elapsed
+
+            if len(compressed) >= len(payload):
+                self.skipped += 1
+                return payload, 0
+
+        return compressed, FLAGS[algorithm]
+
+    def stats(self):
+        with self._lock:
+            result = {"threshold": self.threshold, "incompressible": self.skipped}
+            for algorithm, stats in self._stats.items():
+                result[algorithm] = {
+                    "messages": stats["messages"],
+                    "bytes_in": stats["bytes_in"],
+                    "bytes_out": stats["bytes_out"],
+                    "ratio": round(stats["bytes_in"] / stats["bytes_out"], 2) if stats["bytes_out"] else None,
+                    "ms_per_message": round(stats["seconds"] / stats["messages"] * 1000, 3),
+                }
+            return result
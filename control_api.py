@@ -0,0 +1,168 @@
+import hmac
+import json
+import logging
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+class ControlRequestError(Exception):
+    pass
+
+# Routes return this instead of JSON-serializable data to send a plain body, such as Prometheus metrics.
+TextResponse = namedtuple("TextResponse", ["content_type", "text"])
+
+# Large enough for a batch of hundreds of thousands of SSNs.
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+class ControlServer:
+    def __init__(self, host, port, routes, token=None, max_body_size=MAX_BODY_SIZE):
+        # routes maps (method, path) to a function taking the request parameters and returning JSON-serializable data.
+        self.routes = routes
+        self.token = token
+        self.max_body_size = max_body_size
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="control-api", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+
+    def _authorized(self, header):
+        if not self.token:
+            return True
+        return hmac.compare_digest(header or "", f"Bearer {self.token}")
+
+    def _make_handler(self):
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive lets a script issue many calls over one connection.
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def _dispatch(self, method):
+                url = urlsplit(self.path)
+
+                # Nothing is read from an unauthenticated caller. Whenever a body is left unread, the connection cannot carry
+                # another request and is closed after the response.
+                if not control._authorized(self.headers.get("Authorization")):
+                    self.close_connection = True
+                    self._respond(401, {"error": "missing or invalid token"})
+                    return
+
+                try:
+                    length = self._content_length(method)
+                except ControlRequestError as e:
+                    self.close_connection = True
+                    self._respond(400, {"error": str(e)})
+                    return
+
+                if length > control.max_body_size:
+                    self.close_connection = True
+                    self._respond(413, {"error": f"request body is larger than {control.max_body_size} bytes"})
+                    return
+
+                try:
+                    params = self._read_params(method, url, length)
+                except ControlRequestError as e:
+                    self._respond(400, {"error": str(e)})
+                    return
+
+                route = control.routes.get((method, url.path))
+                if route is None:
+                    self._respond(404, {"error": f"no such operation: {method} {url.path}"})
+                    return
+
+                try:
+                    self._respond(200, route(params))
+                except ControlRequestError as e:
+                    self._respond(400, {"error": str(e)})
+                except Exception:
+                    # Details stay in the server log; they may name tables, hosts or credentials.
+                    logger.exception("Control request %s %s failed", method, url.path)
+                    self._respond(500, {"error": "internal error"})
+
+            def _content_length(self, method):
+                header = self.headers.get("Content-Length")
+
+                if header is None:
+                    # Without a length there is no telling where a POST body ends, for example with chunked encoding.
+                    if method == "POST":
+                        raise ControlRequestError("Content-Length is required")
+                    return 0
+                try:
+                    length = int(header)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    raise ControlRequestError("Content-Length must be a non-negative integer")
+                return length
+
+            def _read_params(self, method, url, length):
+                params = dict(parse_qsl(url.query))
+
+                if length:
+                    body = self.rfile.read(length)
+                    # A GET body is read only so the next request on the connection starts in the right place.
+                    if method != "POST":
+                        return params
+                    try:
+                        body = json.loads(body)
+                    except ValueError:
+                        raise ControlRequestError("request body is not valid JSON")
+                    if not isinstance(body, dict):
+                        raise ControlRequestError("request body must be a JSON object")
+                    params.update(body)
+
+                return params
+
+            def _respond(self, status, data):
+                if isinstance(data, TextResponse):
+                    content_type, body = data.content_type, data.text.encode()
+                else:
+                    content_type, body = "application/json", json.dumps(data).encode()
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # One line per request would drown the operator menu at thousands of requests per second.
+                pass
+
+        return Handler
+
+def string_list(params, name, required=True):
+    value = params.get(name)
+
+    if value is None:
+        if required:
+            raise ControlRequestError(f"'{name}' is required")
+        return None
+    if isinstance(value, str):
+        value = [item for item in value.split(",") if item]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ControlRequestError(f"'{name}' must be a list of strings")
+    return value
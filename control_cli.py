@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import sys
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+CONTROL_HOST = os.getenv("CONTROL_HOST", "127.0.0.1")
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "12346"))
+CONTROL_TOKEN = os.getenv("CONTROL_TOKEN")
+
+def call(method, path, params=None, url=None, token=None):
+    url = (url or f"http://{CONTROL_HOST}:{CONTROL_PORT}") + path
+    data = None
+
+    if method == "GET" and params:
+        url += "?" + urlencode(params)
+    elif method == "POST":
+        data = json.dumps(params or {}).encode()
+
+    request = Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    token = token or CONTROL_TOKEN
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+
+    try:
+        with urlopen(request) as response:
+            if response.headers.get_content_type() != "application/json":
+                return response.read().decode()
+            return json.loads(response.read())
+    except HTTPError as e:
+        raise SystemExit(f"{e.code}: {json.loads(e.read()).get('error')}")
+
+def read_ssns(args):
+    ssns = list(args.ssn or [])
+
+    # "-" reads one SSN per line from standard input, so large batches can be piped in.
+    if args.ssn_file:
+        with (sys.stdin if args.ssn_file == "-" else open(args.ssn_file)) as f:
+            ssns.extend(line.strip() for line in f if line.strip())
+
+    if not ssns:
+        raise SystemExit("At least one --ssn or an --ssn-file is required")
+    return ssns
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a running server through its control API.")
+    parser.add_argument("--url", help=f"defaults to http://{CONTROL_HOST}:{CONTROL_PORT}")
+    parser.add_argument("--token", help="defaults to CONTROL_TOKEN")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    show = commands.add_parser("show", help="print a server table")
+    show.add_argument("table", choices=["clients", "personnel", "messages"])
+
+    commands.add_parser("stats", help="print cache, pool and connection statistics")
+
+    for name, help_text in (("send", "send personnel to clients"), ("delete", "delete personnel from clients")):
+        push = commands.add_parser(name, help=help_text)
+        push.add_argument("--ssn", action="append", help="may be repeated")
+        push.add_argument("--ssn-file", help="file with one SSN per line, or - for standard input")
+        push.add_argument("--client", action="append", help="client name, may be repeated; defaults to all clients")
+
+    commands.add_parser("sync", help="send all personnel to all clients")
+    commands.add_parser("delete-all", help="delete all personnel from all clients")
+
+    deliveries = commands.add_parser("deliveries", help="print delivery statistics and recent failures")
+    deliveries.add_argument("--limit", type=int, default=100)
+
+    commands.add_parser("retry", help="resend failed SAVE and DELETE deliveries")
+    commands.add_parser("metrics", help="print the server's metrics in Prometheus text format")
+
+    compact = commands.add_parser("compact", help="delete old message log rows and the payloads they no longer need")
+    compact.add_argument("--days", type=float, help="keep this many days; defaults to MESSAGE_RETENTION_DAYS on the server")
+    compact.add_argument("--rows", type=int, help="keep this many rows; defaults to MESSAGE_RETENTION_ROWS on the server")
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        result = call("GET", "/table", {"table": args.table}, args.url, args.token)
+    elif args.command == "stats":
+        result = call("GET", "/stats", None, args.url, args.token)
+    elif args.command == "metrics":
+        print(call("GET", "/metrics", None, args.url, args.token), end="")
+        return
+    elif args.command == "deliveries":
+        result = call("GET", "/deliveries", {"limit": args.limit}, args.url, args.token)
+    elif args.command == "compact":
+        params = {key: value for key, value in (("days", args.days), ("rows", args.rows)) if value is not None}
+        result = call("POST", "/compact", params, args.url, args.token)
+    elif args.command in ("send", "delete"):
+        params = {"ssns": read_ssns(args)}
+        if args.client:
+            params["clients"] = args.client
+        result = call("POST", f"/{args.command}", params, args.url, args.token)
+    else:
+        result = call("POST", f"/{args.command}", None, args.url, args.token)
+
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
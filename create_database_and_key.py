@@ -1,43 +1,63 @@
 import os
-import sqlite3
 from sqlalchemy import create_engine, text
 from cryptography.fernet import Fernet
 from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
+from client_store import PersonnelStore
 
 load_dotenv(override=True)
 
 def create_sqlite_database_client_one():
-    conn = sqlite3.connect('client_one_database.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS personnel (
-        ID INTEGER PRIMARY KEY,
-        NAME TEXT,
-        SURNAME TEXT,
-        SSN TEXT
-    )
-    ''')
-
-    conn.commit()
-    conn.close()
+    store = PersonnelStore('client_one_database.db')
+    store.close()
 
 def create_sqlite_database_client_two():
-    conn = sqlite3.connect('client_two_database.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS personnel (
-        ID INTEGER PRIMARY KEY,
-        NAME TEXT,
-        SURNAME TEXT,
-        SSN TEXT
-    )
-    ''')
-
-    conn.commit()
-    conn.close()    
+    store = PersonnelStore('client_two_database.db')
+    store.close()
+
+def create_personnel_change_log(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS personnel_changes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            ssn VARCHAR(11) NOT NULL,
+            operation VARCHAR(6) NOT NULL,
+            name VARCHAR(100),
+            surname VARCHAR(100)
+        );
+    """))
+
+    connection.execute(text("DROP TRIGGER IF EXISTS personnel_after_insert;"))
+    connection.execute(text("""
+        CREATE TRIGGER personnel_after_insert AFTER INSERT ON personnel FOR EACH ROW
+            INSERT INTO personnel_changes (ssn, operation, name, surname)
+            VALUES (NEW.ssn, 'UPSERT', NEW.name, NEW.surname);
+    """))
+
+    connection.execute(text("DROP TRIGGER IF EXISTS personnel_after_update;"))
+    connection.execute(text("""
+        CREATE TRIGGER personnel_after_update AFTER UPDATE ON personnel FOR EACH ROW
+        BEGIN
+            IF OLD.ssn <> NEW.ssn THEN
+                INSERT INTO personnel_changes (ssn, operation) VALUES (OLD.ssn, 'DELETE');
+            END IF;
+            INSERT INTO personnel_changes (ssn, operation, name, surname)
+            VALUES (NEW.ssn, 'UPSERT', NEW.name, NEW.surname);
+        END;
+    """))
+
+    connection.execute(text("DROP TRIGGER IF EXISTS personnel_after_delete;"))
+    connection.execute(text("""
+        CREATE TRIGGER personnel_after_delete AFTER DELETE ON personnel FOR EACH ROW
+            INSERT INTO personnel_changes (ssn, operation) VALUES (OLD.ssn, 'DELETE');
+    """))
+
+def create_payloads_table(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS payloads (
+            hash CHAR(64) PRIMARY KEY,
+            payload JSON NOT NULL
+        );
+    """))
 
 def create_mysql_database():
     mysql_username = os.getenv('MYSQL_USERNAME')
@@ -66,7 +86,12 @@ def create_mysql_database():
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 name VARCHAR(100) NOT NULL,
                 host VARCHAR(100) NOT NULL,
-                port INT NOT NULL
+                port INT NOT NULL,
+                uid VARCHAR(32) NULL,
+                last_seen DATETIME NULL,
+                UNIQUE KEY clients_name (name),
+                KEY clients_host_port (host, port),
+                UNIQUE KEY clients_uid (uid)
             );
         """))
 
@@ -75,19 +100,33 @@ def create_mysql_database():
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 name VARCHAR(100) NOT NULL,
                 surname VARCHAR(100) NOT NULL,
-                ssn VARCHAR(11) NOT NULL
+                ssn VARCHAR(11) NOT NULL,
+                UNIQUE KEY personnel_ssn (ssn)
             );
         """))
 
+        create_payloads_table(connection)
+
         connection.execute(text("""
             CREATE TABLE IF NOT EXISTS messages (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 client_id INT NOT NULL,
-                payload JSON NOT NULL,
-                FOREIGN KEY (client_id) REFERENCES clients(id)
+                payload_hash CHAR(64) NOT NULL,
+                operation_id INT NULL,
+                status VARCHAR(8) NULL,
+                latency_ms DOUBLE NULL,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                KEY messages_client_id (client_id),
+                KEY messages_operation_id (operation_id, client_id),
+                KEY messages_client_operation (client_id, operation_id),
+                KEY messages_payload_hash (payload_hash),
+                FOREIGN KEY (client_id) REFERENCES clients(id),
+                FOREIGN KEY (payload_hash) REFERENCES payloads(hash)
             );
         """))
 
+        create_personnel_change_log(connection)
+
         personnel_dummy_data = [
             ('Bugra', 'Ercan', '313-88-9999'),
             ('Sefa', 'Keles', '999-11-2222'),
@@ -97,7 +136,7 @@ def create_mysql_database():
         ]
         
         for data in personnel_dummy_data:
-            connection.execute(text("INSERT INTO personnel (name, surname, ssn) VALUES (:name, :surname, :ssn);"), {"name": data[0], "surname": data[1], "ssn": data[2]})
+            connection.execute(text("INSERT IGNORE INTO personnel (name, surname, ssn) VALUES (:name, :surname, :ssn);"), {"name": data[0], "surname": data[1], "ssn": data[2]})
 
         connection.commit()
 
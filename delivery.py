@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+DELIVERY_SENT = "sent"
+DELIVERY_ACKED = "acked"
+DELIVERY_FAILED = "failed"
+
+# written is set once the frame reached the client's socket; until then a reconnecting client can't have applied it.
+Delivery = namedtuple("Delivery", ["operation_id", "client_id", "action", "message_json", "sent_at", "written"])
+
+FailedDelivery = namedtuple("FailedDelivery", ["operation_id", "client_id", "action", "message_json", "reason", "written"])
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))], 3)
+
+class DeliveryTracker:
+    def __init__(self, window=128, ack_timeout=30.0, on_status=None, history=10000):
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.on_status = on_status
+
+        # Acks arrive on the event loop while sends are tracked from the menu and control API threads.
+        self._lock = threading.Lock()
+        self._outstanding = {}
+        self._failed = OrderedDict()
+        self._history = history
+        self._latencies = deque(maxlen=history)
+
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.applied_rows = 0
+
+    def _notify_status(self, updates):
+        if self.on_status is not None and updates:
+            self.on_status(updates)
+
+    def _expire(self, client_id, now, updates):
+        outstanding = self._outstanding.get(client_id)
+
+        # Deliveries are kept in send order, so expired ones are always at the front.
+        while outstanding:
+            delivery = next(iter(outstanding.values()))
+            if now - delivery.sent_at < self.ack_timeout:
+                break
+            del outstanding[delivery.operation_id]
+            self._record_failure(delivery, "ack timed out", updates)
+
+    def _record_failure(self, delivery, reason, updates):
+        self.failed += 1
+        self._failed[(delivery.operation_id, delivery.client_id)] = FailedDelivery(
+            delivery.operation_id, delivery.client_id, delivery.action, delivery.message_json, reason, delivery.written
+        )
+        while len(self._failed) > self._history:
+            self._failed.popitem(last=False)
+        updates.append((delivery.operation_id, delivery.client_id, DELIVERY_FAILED, None))
+
+    def has_room(self, client_id):
+        updates = []
+
+        with self._lock:
+            self._expire(client_id, time.monotonic(), updates)
+            room = len(self._outstanding.get(client_id, ())) < self.window
+
+        self._notify_status(updates)
+        return room
+
+    def track(self, operation_id, client_ids, action, message_json, retry=False, written=False):
+        now = time.monotonic()
+
+        with self._lock:
+            for client_id in client_ids:
+                if self._failed.pop((operation_id, client_id), None) is not None:
+                    self.failed -= 1
+                delivery = Delivery(operation_id, client_id, action, message_json, now, written)
+                self._outstanding.setdefault(client_id, OrderedDict())[operation_id] = delivery
+            self.sent += len(client_ids)
+
+        if retry:
+            self._notify_status([(operation_id, client_id, DELIVERY_SENT, None) for client_id in client_ids])
+
+    def fail(self, operation_id, client_id, reason):
+        updates = []
+
+        with self._lock:
+            delivery = self._outstanding.get(client_id, {}).pop(operation_id, None)
+            if delivery is not None:
+                self._record_failure(delivery, reason, updates)
+
+        self._notify_status(updates)
+
+    def drop_client(self, client_id, reason="disconnected"):
+        updates = []
+
+        with self._lock:
+            for delivery in self._outstanding.pop(client_id, {}).values():
+                self._record_failure(delivery, reason, updates)
+
+        self._notify_status(updates)
+
+    def mark_written(self, operation_id, client_ids):
+        with self._lock:
+            for client_id in client_ids:
+                outstanding = self._outstanding.get(client_id)
+                delivery = outstanding.get(operation_id) if outstanding else None
+                if delivery is not None:
+                    outstanding[operation_id] = delivery._replace(written=True)
+
+    def reconnect_client(self, client_id, applied_operation_id):
+        # A reconnecting client reports the last operation it applied. Frames are written in order, so a written delivery
+        # up to that operation arrived even if its ack was lost; everything else failed with the old connection.
+        # Returns the client's failures that never reached it but are older than what it applied: gaps the
+        # client can't know about, which must be replayed along with what came after.
+        updates = []
+
+        with self._lock:
+            for delivery in self._outstanding.pop(client_id, {}).values():
+                if delivery.written and delivery.operation_id <= applied_operation_id:
+                    self.acked += 1
+                    updates.append((delivery.operation_id, client_id, DELIVERY_ACKED, None))
+                else:
+                    self._record_failure(delivery, "reconnected", updates)
+
+            gaps = [
+                failure for failure in self._failed.values()
+                if failure.client_id == client_id and not failure.written and failure.operation_id <= applied_operation_id
+            ]
+
+        self._notify_status(updates)
+        return gaps
+
+    def ack(self, client_id, operation_id, rows=0, apply_ms=None, error=None):
+        now = time.monotonic()
+
+        with self._lock:
+            delivery = self._outstanding.get(client_id, {}).pop(operation_id, None)
+            if delivery is None:
+                # A late ack for a delivery that already timed out still counts.
+                late = self._failed.pop((operation_id, client_id), None)
+                if late is None:
+                    return None
+                self.failed -= 1
+                delivery = Delivery(late.operation_id, late.client_id, late.action, late.message_json, None, late.written)
+
+            latency_ms = None if delivery.sent_at is None else (now - delivery.sent_at) * 1000
+            if error:
+                self._record_failure(delivery, f"client error: {error}", [])
+                status = DELIVERY_FAILED
+            else:
+                self.acked += 1
+                self.applied_rows += rows or 0
+                if latency_ms is not None:
+                    self._latencies.append(latency_ms)
+                status = DELIVERY_ACKED
+
+        self._notify_status([(operation_id, client_id, status, latency_ms)])
+        return delivery
+
+    def outstanding(self):
+        with self._lock:
+            return sum(len(outstanding) for outstanding in self._outstanding.values())
+
+    def take_failed(self, actions=None, client_ids=None):
+        with self._lock:
+            taken = [
+                failure for failure in self._failed.values()
+                if (actions is None or failure.action in actions) and (client_ids is None or failure.client_id in client_ids)
+            ]
+            for failure in taken:
+                del self._failed[(failure.operation_id, failure.client_id)]
+            self.failed -= len(taken)
+        return taken
+
+    def failed_deliveries(self, limit=100):
+        # A slice of [-0:] would be every failure, so a non-positive limit returns none.
+        if limit <= 0:
+            return []
+
+        with self._lock:
+            failures = list(self._failed.values())[-limit:]
+        return [
+            {"operation_id": f.operation_id, "client_id": f.client_id, "action": f.action, "reason": f.reason}
+            for f in failures
+        ]
+
+    def stats(self):
+        now = time.monotonic()
+        updates = []
+
+        with self._lock:
+            for client_id in list(self._outstanding):
+                self._expire(client_id, now, updates)
+
+            latencies = sorted(self._latencies)
+            stats = {
+                "sent": self.sent,
+                "acked": self.acked,
+                "failed": self.failed,
+                "outstanding": sum(len(outstanding) for outstanding in self._outstanding.values()),
+                "max_in_flight": max((len(outstanding) for outstanding in self._outstanding.values()), default=0),
+                "window": self.window,
+                "applied_rows": self.applied_rows,
+                "latency_ms": {
+                    "samples": len(latencies),
+                    "p50": percentile(latencies, 0.50),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                    "max": percentile(latencies, 1.0),
+                },
+            }
+
+        self._notify_status(updates)
+        return stats
@@ -0,0 +1,294 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+class MessageLogWriter:
+    def __init__(
+        self, session_factory, model, payload_model, flush_size=1000, flush_interval=1.0, background=False,
+        retention_age=None, retention_rows=None, retention_interval=3600.0, batch_size=10000, on_compact=None
+    ):
+        self.session_factory = session_factory
+        self.model = model
+        self.payload_model = payload_model
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self.retention_age = retention_age
+        self.retention_rows = retention_rows
+        self.retention_interval = retention_interval
+        self.batch_size = batch_size
+        self.on_compact = on_compact
+
+        self._pending = []
+        self._pending_payloads = {}
+        self._pending_updates = []
+        self._condition = threading.Condition()
+        self._flusher = None
+        self._stopping = False
+
+        # Writes that reference payloads and compaction, which deletes unreferenced ones, must not interleave.
+        self._payload_lock = threading.Lock()
+        self._compactor = None
+        self._compactor_stopped = threading.Event()
+
+    def log(self, client_ids, payload, operation_id=None):
+        self.log_many([(client_ids, payload, operation_id)])
+
+    def log_many(self, entries):
+        # Each payload is stored once, keyed by its SHA-256; the per-client rows only carry the hash.
+        payloads = {}
+        rows = []
+        now = datetime.now()
+
+        for client_ids, payload, operation_id in entries:
+            if not client_ids:
+                continue
+
+            payload_hash = hashlib.sha256(payload.encode()).hexdigest()
+            payloads[payload_hash] = payload
+            status = "sent" if operation_id else None
+            rows.extend(
+                {"client_id": client_id, "payload_hash": payload_hash, "operation_id": operation_id, "status": status, "created_at": now}
+                for client_id in client_ids
+            )
+        if not rows:
+            return
+
+        if not self.background:
+            self._write(payloads, rows, [])
+            return
+
+        with self._condition:
+            self._pending_payloads.update(payloads)
+            self._pending.extend(rows)
+            if len(self._pending) >= self.flush_size:
+                self._condition.notify()
+
+    def update_status(self, updates):
+        # updates are (operation_id, client_id, status, latency_ms) tuples reported by the delivery tracker. They arrive
+        # one ack at a time, so they are always left to the flusher and written in batches, even without background mode.
+        rows = [
+            {"b_operation_id": operation_id, "b_client_id": client_id, "b_status": status, "b_latency_ms": latency_ms}
+            for operation_id, client_id, status, latency_ms in updates
+        ]
+        if not rows:
+            return
+
+        with self._condition:
+            self._pending_updates.extend(rows)
+            if len(self._pending_updates) >= self.flush_size:
+                self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending) + len(self._pending_updates)
+
+    def _write(self, payloads, rows, status_rows):
+        if rows:
+            with self._payload_lock:
+                self._write_rows(payloads, rows, status_rows)
+        else:
+            self._write_rows(payloads, rows, status_rows)
+
+    def _write_rows(self, payloads, rows, status_rows):
+        session = self.session_factory()
+
+        try:
+            # One multi-row INSERT and one commit for the whole batch; status updates follow the rows they touch.
+            # Payloads already stored by an earlier batch are skipped by the database.
+            if payloads:
+                session.execute(
+                    insert(self.payload_model).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite"),
+                    [{"hash": payload_hash, "payload": payload} for payload_hash, payload in payloads.items()]
+                )
+            if rows:
+                session.execute(insert(self.model), rows)
+            if status_rows:
+                table = self.model.__table__
+                session.connection().execute(
+                    update(table)
+                    .where(table.c.operation_id == bindparam("b_operation_id"), table.c.client_id == bindparam("b_client_id"))
+                    .values(status=bindparam("b_status"), latency_ms=bindparam("b_latency_ms")),
+                    status_rows
+                )
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def flush(self):
+        with self._condition:
+            payloads = self._pending_payloads
+            rows = self._pending
+            status_rows = self._pending_updates
+            self._pending_payloads = {}
+            self._pending = []
+            self._pending_updates = []
+
+        if rows or status_rows:
+            try:
+                self._write(payloads, rows, status_rows)
+            except SQLAlchemyError as e:
+                logger.error(
+                    "Error occurred while writing %d messages and %d status updates to the database: %s", len(rows), len(status_rows), e
+                )
+
+    def compact(self, max_age=None, max_rows=None):
+        # Deletes the oldest rows beyond max_age seconds or max_rows rows in batches, each in its own short transaction,
+        # together with the payloads no remaining row refers to. Returns the number of rows and payloads deleted.
+        max_age = self.retention_age if max_age is None else max_age
+        max_rows = self.retention_rows if max_rows is None else max_rows
+        model = self.model
+        table = model.__table__
+        payload_table = self.payload_model.__table__
+
+        start = time.perf_counter()
+        deleted_rows = 0
+        deleted_payloads = 0
+        session = self.session_factory()
+
+        try:
+            bounds = []
+            if max_age:
+                # Rows without a timestamp predate the column, so they are older than any age limit.
+                bounds.append(or_(model.created_at.is_(None), model.created_at < datetime.now() - timedelta(seconds=max_age)))
+            if max_rows:
+                boundary = session.query(model.id).order_by(model.id.desc()).offset(max_rows).limit(1).scalar()
+                if boundary is not None:
+                    bounds.append(model.id <= boundary)
+            if not bounds:
+                return 0, 0
+
+            conditions = [or_(*bounds)]
+            # The newest operation id seeds the id sequence after a restart, so its rows are always kept.
+            newest = session.query(func.max(model.operation_id)).scalar()
+            if newest is not None:
+                conditions.append(or_(model.operation_id.is_(None), model.operation_id < newest))
+
+            while True:
+                batch = session.query(model.id, model.payload_hash).filter(*conditions).order_by(model.id).limit(self.batch_size).all()
+                # Ends the read, so the reference check below sees every batch written since.
+                session.commit()
+                if not batch:
+                    break
+
+                hashes = {payload_hash for _, payload_hash in batch}
+                with self._payload_lock:
+                    session.execute(delete(table).where(table.c.id.in_([row_id for row_id, _ in batch])))
+                    in_use = {
+                        payload_hash for (payload_hash,) in
+                        session.query(model.payload_hash).filter(model.payload_hash.in_(hashes)).distinct()
+                    }
+                    unused = hashes - in_use
+                    if unused:
+                        session.execute(delete(payload_table).where(payload_table.c.hash.in_(unused)))
+                    session.commit()
+
+                deleted_rows += len(batch)
+                deleted_payloads += len(unused)
+                if len(batch) < self.batch_size:
+                    break
+
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error("Error occurred while compacting the message log: %s", e)
+        finally:
+            session.close()
+
+        if self.on_compact is not None:
+            self.on_compact(deleted_rows, deleted_payloads, time.perf_counter() - start)
+        return deleted_rows, deleted_payloads
+
+    def delete_clients(self, client_model, *conditions):
+        # Deletes the clients matching conditions together with their rows and the payloads only those rows referred to,
+        # in one transaction. The conditions are checked while holding the payload lock, so no new rows for them appear.
+        # Returns the ids of the deleted clients.
+        self.flush()
+        table = self.model.__table__
+        client_table = client_model.__table__
+        payload_table = self.payload_model.__table__
+        session = self.session_factory()
+
+        try:
+            with self._payload_lock:
+                client_ids = [client_id for (client_id,) in session.query(client_model.id).filter(*conditions)]
+                if not client_ids:
+                    return []
+
+                hashes = {
+                    payload_hash for (payload_hash,) in
+                    session.query(self.model.payload_hash).filter(self.model.client_id.in_(client_ids)).distinct()
+                }
+                session.execute(delete(table).where(table.c.client_id.in_(client_ids)))
+                session.execute(delete(client_table).where(client_table.c.id.in_(client_ids)))
+                in_use = {
+                    payload_hash for (payload_hash,) in
+                    session.query(self.model.payload_hash).filter(self.model.payload_hash.in_(hashes)).distinct()
+                }
+                if hashes - in_use:
+                    session.execute(delete(payload_table).where(payload_table.c.hash.in_(hashes - in_use)))
+                session.commit()
+
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error("Error occurred while deleting expired clients from the message log: %s", e)
+            return []
+        finally:
+            session.close()
+
+        return client_ids
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run_flusher, name="message-log", daemon=True)
+            self._flusher.start()
+
+        if (self.retention_age or self.retention_rows) and self._compactor is None:
+            self._compactor_stopped.clear()
+            self._compactor = threading.Thread(target=self._run_compactor, name="message-log-compactor", daemon=True)
+            self._compactor.start()
+
+    def stop(self):
+        if self._compactor is not None:
+            self._compactor_stopped.set()
+            self._compactor.join()
+            self._compactor = None
+
+        if self._flusher is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify()
+            self._flusher.join()
+            self._flusher = None
+
+        self.flush()
+
+    def _run_flusher(self):
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+
+            with self._condition:
+                while not self._stopping and len(self._pending) + len(self._pending_updates) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+
+            self.flush()
+
+            if stopping:
+                return
+
+    def _run_compactor(self):
+        while not self._compactor_stopped.wait(self.retention_interval):
+            self.compact()
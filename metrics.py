@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from sub-millisecond encryptions up to multi-second snapshot broadcasts.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class CounterValue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name + "_total", labels, self.value)]
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            total = self.sum
+
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            samples.append((name + "_bucket", labels + (("le", format_value(bound)),), cumulative))
+        samples.append((name + "_sum", labels, total))
+        samples.append((name + "_count", labels, count))
+        return samples
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._children = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        with self._lock:
+            children = list(self._children.items())
+
+        samples = []
+        for values, child in children:
+            samples.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return self.name, self.help, self.type, samples
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    @property
+    def value(self):
+        return self._default.value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name, help, read):
+        # Gauges are read when scraped, so keeping them current costs nothing on the hot path.
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def collect(self):
+        return self.name, self.help, self.type, [(self.name, (), self.read())]
+
+def merge_families(collections):
+    # Sums the samples of the same metrics collected in several processes, e.g. the workers of one server.
+    families = {}
+
+    for collection in collections:
+        for name, help, type, samples in collection:
+            merged = families.setdefault(name, (help, type, {}))[2]
+            for sample_name, labels, value in samples:
+                merged[(sample_name, labels)] = merged.get((sample_name, labels), 0) + value
+
+    return [
+        (name, help, type, [(sample_name, labels, value) for (sample_name, labels), value in merged.items()])
+        for name, (help, type, merged) in families.items()
+    ]
+
+def render_families(families):
+    lines = []
+    for name, help, type, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+class MetricsRegistry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self.prefix + name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read):
+        return self._register(Gauge(self.prefix + name, help, read))
+
+    def collect(self):
+        return [metric.collect() for metric in self._metrics]
+
+    def render(self):
+        return render_families(self.collect())
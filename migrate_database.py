@@ -0,0 +1,196 @@
+import os
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from dotenv import load_dotenv
+from create_database_and_key import create_payloads_table, create_personnel_change_log
+
+load_dotenv(override=True)
+
+# (table, index name, columns, unique) for every lookup the server makes on a hot path.
+INDEXES = [
+    ("clients", "clients_name", ("name",), True),
+    ("clients", "clients_host_port", ("host", "port"), False),
+    ("clients", "clients_uid", ("uid",), True),
+    ("personnel", "personnel_ssn", ("ssn",), True),
+    ("messages", "messages_client_id", ("client_id",), False),
+    ("messages", "messages_operation_id", ("operation_id", "client_id"), False),
+    ("messages", "messages_client_operation", ("client_id", "operation_id"), False),
+    ("messages", "messages_payload_hash", ("payload_hash",), False),
+]
+
+# (table, column, definition) for columns added after the table was first created.
+COLUMNS = [
+    ("clients", "uid", "VARCHAR(32) NULL"),
+    # Empty on existing rows; client expiry treats them as long gone unless they are connected.
+    ("clients", "last_seen", "DATETIME NULL"),
+    ("messages", "operation_id", "INT NULL"),
+    ("messages", "status", "VARCHAR(8) NULL"),
+    ("messages", "latency_ms", "DOUBLE NULL"),
+    ("messages", "payload_hash", "CHAR(64) NULL"),
+    # Left NULL on existing rows, whose real age is unknown; retention treats them as past any age limit.
+    ("messages", "created_at", "DATETIME NULL"),
+]
+
+PAYLOAD_MOVE_BATCH = 10000
+
+HOT_QUERIES = [
+    ("client by name", "SELECT * FROM clients WHERE name = :name", {"name": "Client #1"}),
+    ("client by address", "SELECT * FROM clients WHERE host = :host AND port = :port", {"host": "127.0.0.1", "port": 50000}),
+    ("client by identity", "SELECT * FROM clients WHERE uid = :uid", {"uid": "0" * 32}),
+    ("personnel by SSN", "SELECT * FROM personnel WHERE ssn = :ssn", {"ssn": "123-45-6789"}),
+    ("messages by client", "SELECT * FROM messages WHERE client_id = :client_id", {"client_id": 1}),
+    ("messages missed by client", "SELECT * FROM messages WHERE client_id = :client_id AND operation_id > :operation_id ORDER BY operation_id", {"client_id": 1, "operation_id": 0}),
+    ("messages by payload", "SELECT * FROM messages WHERE payload_hash = :payload_hash", {"payload_hash": "0" * 64}),
+    ("message by operation", "SELECT * FROM messages WHERE operation_id = :operation_id AND client_id = :client_id", {"operation_id": 1, "client_id": 1}),
+    ("personnel changes since revision", "SELECT * FROM personnel_changes WHERE id > :revision AND id <= :latest", {"revision": 0, "latest": 1}),
+]
+
+def get_indexes(connection, table):
+    rows = connection.execute(text("""
+        SELECT index_name, non_unique, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = :table
+        ORDER BY index_name, seq_in_index;
+    """), {"table": table})
+
+    indexes = {}
+    for index_name, non_unique, column_name in rows:
+        index = indexes.setdefault(index_name, {"unique": not non_unique, "columns": []})
+        index["columns"].append(column_name.lower())
+    return indexes
+
+def get_columns(connection, table):
+    rows = connection.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = :table;
+    """), {"table": table})
+    return {column_name.lower() for (column_name,) in rows}
+
+def has_index(connection, table, columns, unique):
+    for index in get_indexes(connection, table).values():
+        if unique:
+            if index["unique"] and tuple(index["columns"]) == columns:
+                return True
+        # Any index led by the same columns serves the lookup, e.g. the one InnoDB adds for a foreign key.
+        elif tuple(index["columns"][:len(columns)]) == columns:
+            return True
+    return False
+
+def find_duplicates(connection, table, column):
+    rows = connection.execute(text(f"""
+        SELECT {column}, COUNT(*) FROM {table} WHERE {column} IS NOT NULL GROUP BY {column} HAVING COUNT(*) > 1;
+    """))
+    return [(value, count) for value, count in rows]
+
+def rename_duplicate_client_names(connection):
+    # Names handed out concurrently by older servers may repeat; the oldest row keeps the name.
+    result = connection.execute(text("""
+        UPDATE clients c
+        JOIN (SELECT name, MIN(id) AS keep_id FROM clients GROUP BY name HAVING COUNT(*) > 1) d
+            ON c.name = d.name AND c.id <> d.keep_id
+        SET c.name = CONCAT(c.name, ' (', c.id, ')');
+    """))
+    if result.rowcount:
+        print(f"Renamed {result.rowcount} clients with duplicate names")
+
+def move_payloads(connection):
+    # Older databases kept the payload in every messages row; each distinct payload now lives once in payloads,
+    # keyed by the same SHA-256 of its text that the server computes.
+    low, high = connection.execute(text("SELECT MIN(id), MAX(id) FROM messages;")).one()
+    moved = 0
+
+    for start in range(low or 0, (high or 0) + 1, PAYLOAD_MOVE_BATCH):
+        params = {"start": start, "end": start + PAYLOAD_MOVE_BATCH}
+        connection.execute(text("""
+            INSERT IGNORE INTO payloads (hash, payload)
+            SELECT SHA2(JSON_UNQUOTE(payload), 256), payload FROM messages
+            WHERE id >= :start AND id < :end AND payload_hash IS NULL;
+        """), params)
+        moved += connection.execute(text("""
+            UPDATE messages SET payload_hash = SHA2(JSON_UNQUOTE(payload), 256)
+            WHERE id >= :start AND id < :end AND payload_hash IS NULL;
+        """), params).rowcount
+        connection.commit()
+
+    connection.execute(text("ALTER TABLE messages DROP COLUMN payload, MODIFY payload_hash CHAR(64) NOT NULL;"))
+    connection.execute(text("ALTER TABLE messages ADD FOREIGN KEY (payload_hash) REFERENCES payloads(hash);"))
+    distinct = connection.execute(text("SELECT COUNT(*) FROM payloads;")).scalar()
+    print(f"Moved {moved} message payloads into {distinct} stored payloads")
+
+def migrate_mysql_database(connection):
+    create_personnel_change_log(connection)
+    create_payloads_table(connection)
+
+    if not has_index(connection, "clients", ("name",), True):
+        rename_duplicate_client_names(connection)
+
+    for table, column, definition in COLUMNS:
+        if column in get_columns(connection, table):
+            print(f"Column {column} on {table}: already present")
+            continue
+
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition};"))
+        print(f"Column {column} on {table}: added")
+
+    if "payload" in get_columns(connection, "messages"):
+        move_payloads(connection)
+
+    for table, index_name, columns, unique in INDEXES:
+        if has_index(connection, table, columns, unique):
+            print(f"Index {index_name} on {table}: already present")
+            continue
+
+        if unique:
+            duplicates = find_duplicates(connection, table, columns[0])
+            if duplicates:
+                print(f"Index {index_name} on {table}: skipped, {len(duplicates)} duplicate values must be resolved first, e.g. {duplicates[:5]}")
+                continue
+
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        connection.execute(text(f"CREATE {kind} {index_name} ON {table} ({', '.join(columns)});"))
+        print(f"Index {index_name} on {table}: created")
+
+    connection.commit()
+
+def check_query_plans(connection):
+    all_indexed = True
+
+    for label, query, params in HOT_QUERIES:
+        for row in connection.execute(text(f"EXPLAIN {query}"), params).mappings():
+            plan = {key.lower(): value for key, value in row.items()}
+
+            # MySQL reports type ALL for a full table scan; const/ref/range lookups go through an index.
+            if plan["type"] == "ALL":
+                all_indexed = False
+                print(f"{label}: FULL TABLE SCAN on {plan['table']}")
+            else:
+                print(f"{label}: {plan['type']} via {plan['key'] or plan.get('extra')}")
+
+    return all_indexed
+
+def main():
+    mysql_username = os.getenv('MYSQL_USERNAME')
+    mysql_password = os.getenv('MYSQL_PASSWORD')
+    mysql_host = os.getenv('MYSQL_HOST')
+    mysql_port = int(os.getenv('MYSQL_PORT'))
+    mysql_database = os.getenv('MYSQL_DATABASE')
+
+    connection_string = f'mysql+mysqlconnector://{mysql_username}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}'
+    print(f'Using {connection_string}')
+
+    engine = create_engine(connection_string, poolclass=NullPool)
+
+    with engine.connect() as connection:
+        migrate_mysql_database(connection)
+        all_indexed = check_query_plans(connection)
+
+    engine.dispose()
+
+    if all_indexed:
+        print("All hot queries use an index.")
+    else:
+        print("Some hot queries still scan a whole table.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import namedtuple
+
+PersonnelRecord = namedtuple("PersonnelRecord", ["id", "name", "surname", "ssn"])
+
+CachedSnapshot = namedtuple("CachedSnapshot", ["revision", "snapshot_id", "chunks"])
+
+class PersonnelCache:
+    def __init__(self, load_revision, load_personnel_many, ttl=300.0, check_interval=1.0):
+        self.load_revision = load_revision
+        self.load_personnel_many = load_personnel_many
+        self.ttl = ttl
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._by_ssn = {}
+        self._snapshot = None
+        self._revision = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+        self.invalidations = 0
+
+    def _clear(self):
+        self._by_ssn = {}
+        self._snapshot = None
+        self._revision = None
+        self._checked_at = 0.0
+        self.invalidations += 1
+
+    def get_revision(self, session):
+        now = time.monotonic()
+
+        with self._lock:
+            # The TTL bounds staleness even if the change log is not being maintained.
+            if self._revision is not None and now - self._loaded_at > self.ttl:
+                self._clear()
+            if self._revision is not None and now - self._checked_at < self.check_interval:
+                return self._revision
+
+        revision = self.load_revision(session)
+
+        with self._lock:
+            if revision != self._revision:
+                if self._revision is not None:
+                    self._clear()
+                self._revision = revision
+                self._loaded_at = now
+            self._checked_at = now
+
+        return revision
+
+    def get_many(self, session, ssns):
+        self.get_revision(session)
+
+        records = {}
+        missing = []
+        with self._lock:
+            for ssn in ssns:
+                record = self._by_ssn.get(ssn)
+                if record is not None:
+                    records[ssn] = record
+                else:
+                    missing.append(ssn)
+            self.hits += len(records)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = self.load_personnel_many(session, missing)
+            loaded = {ssn: record for ssn, record in loaded.items() if record is not None}
+
+            with self._lock:
+                self._by_ssn.update(loaded)
+            records.update(loaded)
+
+        return records
+
+    def get_snapshot(self, revision):
+        with self._lock:
+            if self._snapshot is not None and self._snapshot.revision == revision == self._revision:
+                self.snapshot_hits += 1
+                return self._snapshot
+            self.snapshot_misses += 1
+            return None
+
+    def store_snapshot(self, revision, snapshot_id, chunks):
+        with self._lock:
+            if revision == self._revision:
+                self._snapshot = CachedSnapshot(revision, snapshot_id, tuple(chunks))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "revision": self._revision,
+                "entries": len(self._by_ssn),
+                "snapshot_chunks": len(self._snapshot.chunks) if self._snapshot else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "snapshot_hits": self.snapshot_hits,
+                "snapshot_misses": self.snapshot_misses,
+                "invalidations": self.invalidations,
+            }
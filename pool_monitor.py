@@ -0,0 +1,92 @@
+import threading
+import time
+
+from sqlalchemy import event
+
+class PoolMonitor:
+    def __init__(self, engine):
+        self.engine = engine
+
+        self._lock = threading.Lock()
+        self._checkout_times = {}
+
+        self.connects = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.longest_checkout = 0.0
+        self.invalidations = 0
+
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            self._checkout_times[id(connection_record)] = time.monotonic()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            started = self._checkout_times.pop(id(connection_record), None)
+            if started is None:
+                return
+            self.checked_out -= 1
+            self.longest_checkout = max(self.longest_checkout, time.monotonic() - started)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        pool = self.engine.pool
+
+        with self._lock:
+            stats = {
+                "pool": type(pool).__name__,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "longest_checkout_seconds": round(self.longest_checkout, 3),
+                "invalidations": self.invalidations,
+            }
+
+        # Only queue-based pools have a fixed size and an overflow to report.
+        if hasattr(pool, "size") and hasattr(pool, "overflow"):
+            stats["size"] = pool.size()
+            stats["overflow"] = pool.overflow()
+        return stats
+
+def watch_queries(engine, session_factory, query_seconds, commit_seconds):
+    # Statement times come from the cursor events; a session commit includes the flush that precedes it.
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        query_seconds.observe(time.perf_counter() - connection.info["query_started"].pop())
+
+    def handle_error(exception_context):
+        if exception_context.connection is not None and exception_context.connection.info.get("query_started"):
+            exception_context.connection.info["query_started"].pop()
+
+    def before_commit(session):
+        session.info["commit_started"] = time.perf_counter()
+
+    def after_commit(session):
+        started = session.info.pop("commit_started", None)
+        if started is not None:
+            commit_seconds.observe(time.perf_counter() - started)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+    event.listen(session_factory, "before_commit", before_commit)
+    event.listen(session_factory, "after_commit", after_commit)
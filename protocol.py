@@ -0,0 +1,105 @@
+import asyncio
+import struct
+from collections import namedtuple
+
+PROTOCOL_VERSION = 1
+
+# Every frame starts with: payload length, protocol version, message type, flags.
+HEADER = struct.Struct("!IBBB")
+
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+MESSAGE_TYPE_DATA = 1
+MESSAGE_TYPE_HELLO = 2
+MESSAGE_TYPE_WELCOME = 3
+MESSAGE_TYPE_ACK = 4
+MESSAGE_TYPE_PING = 5
+MESSAGE_TYPE_PONG = 6
+
+# Set on DATA frames whose decrypted payload uses the compact encoding instead of JSON.
+FLAG_COMPACT = 0x01
+
+# At most one of these is set on DATA frames whose payload was compressed before encryption.
+FLAG_ZLIB = 0x02
+FLAG_LZMA = 0x04
+FLAG_ZSTD = 0x08
+
+RECV_BUFFER_SIZE = 64 * 1024
+
+Frame = namedtuple("Frame", ["message_type", "flags", "payload"])
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(payload, message_type=MESSAGE_TYPE_DATA, flags=0):
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds the {MAX_PAYLOAD_SIZE} byte limit")
+
+    return HEADER.pack(len(payload), PROTOCOL_VERSION, message_type, flags) + payload
+
+def send_frame(sock, payload, message_type=MESSAGE_TYPE_DATA, flags=0):
+    sock.sendall(encode_frame(payload, message_type, flags))
+
+def decode_header(header):
+    length, version, message_type, flags = HEADER.unpack(header)
+
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the {MAX_PAYLOAD_SIZE} byte limit")
+
+    return length, message_type, flags
+
+class FrameReader:
+    def __init__(self, sock, buffer_size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def read_frame(self):
+        while True:
+            frame = self._pop_frame()
+            if frame is not None:
+                return frame
+
+            chunk = self.sock.recv(self.buffer_size)
+            if not chunk:
+                if self.buffer:
+                    raise ProtocolError("Connection closed in the middle of a frame")
+                return None
+
+            self.buffer += chunk
+
+    def _pop_frame(self):
+        if len(self.buffer) < HEADER.size:
+            return None
+
+        length, message_type, flags = decode_header(self.buffer[:HEADER.size])
+        end = HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+
+        payload = bytes(self.buffer[HEADER.size:end])
+        del self.buffer[:end]
+        return Frame(message_type, flags, payload)
+
+async def read_frame_async(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError("Connection closed in the middle of a frame")
+        return None
+
+    length, message_type, flags = decode_header(header)
+
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed in the middle of a frame")
+
+    return Frame(message_type, flags, payload)
+
+async def write_encoded_frame_async(writer, frame):
+    writer.write(frame)
+    await writer.drain()
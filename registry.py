@@ -0,0 +1,49 @@
+import threading
+
+class ConnectionRegistry:
+    def __init__(self):
+        # Connections are added/removed on the event loop and read from the menu thread.
+        self._lock = threading.Lock()
+        self._by_address = {}
+        self._by_id = {}
+        self._snapshot = ()
+
+    def __len__(self):
+        return len(self._by_address)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def add(self, connection):
+        with self._lock:
+            self._by_address[connection.address] = connection
+            self._snapshot = None
+
+    def bind(self, connection, client_id, client_name):
+        with self._lock:
+            connection.client_id = client_id
+            connection.client_name = client_name
+            self._by_id[client_id] = connection
+
+    def remove(self, connection):
+        with self._lock:
+            if self._by_address.get(connection.address) is connection:
+                del self._by_address[connection.address]
+                self._snapshot = None
+            if connection.client_id is not None and self._by_id.get(connection.client_id) is connection:
+                del self._by_id[connection.client_id]
+
+    def get_by_address(self, client_host, client_port):
+        return self._by_address.get((client_host, client_port))
+
+    def get_by_id(self, client_id):
+        return self._by_id.get(client_id)
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._by_address.values())
+                snapshot = self._snapshot
+        return snapshot
@@ -1,16 +1,46 @@
+import asyncio
 import json
-import socket
+import logging
+import multiprocessing
 import os
+import signal
+import socket
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 import threading
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, func, JSON
+from sqlalchemy import create_engine, select, Column, DateTime, Float, Index, Integer, String, ForeignKey, func, or_, JSON
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy.exc import SQLAlchemyError
-from cryptography.fernet import Fernet
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from protocol import (
+    FLAG_COMPACT, MESSAGE_TYPE_ACK, MESSAGE_TYPE_DATA, MESSAGE_TYPE_HELLO, MESSAGE_TYPE_PING, MESSAGE_TYPE_WELCOME,
+    ProtocolError, encode_frame, read_frame_async
+)
+from codec import ENCODING_COMPACT, choose_encoding, encode_compact
+from compression import AVAILABLE_COMPRESSIONS, Compressor
+from delivery import DeliveryTracker
+from session_cipher import DIRECTION_TO_SERVER, SessionCipher, choose_cipher, new_handshake_nonce
+from broadcast import BroadcastReport, ClientConnection, DeliveryError, broadcast, merge_reports
+from control_api import MAX_BODY_SIZE, ControlRequestError, ControlServer, TextResponse, string_list
+from message_log import MessageLogWriter
+from metrics import CONTENT_TYPE, MetricsRegistry, merge_families, render_families
+from personnel_cache import PersonnelCache, PersonnelRecord
+from pool_monitor import PoolMonitor, watch_queries
+from registry import ConnectionRegistry
+from workers import Channel, ChannelClosed, RemoteConnection
 
 load_dotenv(override=True)
 
-connected_clients = []
+logger = logging.getLogger("server")
+
+connected_clients = ConnectionRegistry()
 
 with open("fernet_key.key", "rb") as f:
     key = f.read()
@@ -25,20 +55,149 @@ MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
 
 SERVER_HOST = os.getenv("SERVER_HOST")
 SERVER_PORT = int(os.getenv("SERVER_PORT"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "1024"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SEND_TIMEOUT = float(os.getenv("SEND_TIMEOUT", "10"))
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "256"))
+SLOW_SEND_THRESHOLD = float(os.getenv("SLOW_SEND_THRESHOLD", "1"))
+MESSAGE_LOG_BACKGROUND = os.getenv("MESSAGE_LOG_BACKGROUND", "false").lower() == "true"
+MESSAGE_LOG_FLUSH_SIZE = int(os.getenv("MESSAGE_LOG_FLUSH_SIZE", "1000"))
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv("MESSAGE_LOG_FLUSH_INTERVAL", "1"))
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+MESSAGE_RETENTION_ROWS = int(os.getenv("MESSAGE_RETENTION_ROWS", "0"))
+MESSAGE_RETENTION_INTERVAL = float(os.getenv("MESSAGE_RETENTION_INTERVAL", "3600"))
+MESSAGE_RETENTION_BATCH_SIZE = int(os.getenv("MESSAGE_RETENTION_BATCH_SIZE", "10000"))
+HANDSHAKE_TIMEOUT = float(os.getenv("HANDSHAKE_TIMEOUT", "10"))
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "10000"))
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", "1000"))
+PERSONNEL_CACHE_TTL = float(os.getenv("PERSONNEL_CACHE_TTL", "300"))
+PERSONNEL_CACHE_CHECK_INTERVAL = float(os.getenv("PERSONNEL_CACHE_CHECK_INTERVAL", "1"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+COMPRESSION = [algorithm for algorithm in os.getenv("COMPRESSION", ",".join(AVAILABLE_COMPRESSIONS)).split(",") if algorithm]
+COMPRESSION_THRESHOLD = int(os.getenv("COMPRESSION_THRESHOLD", "1024"))
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "10"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "45"))
+TCP_KEEPALIVE_IDLE = int(os.getenv("TCP_KEEPALIVE_IDLE", "30"))
+TCP_KEEPALIVE_INTERVAL = int(os.getenv("TCP_KEEPALIVE_INTERVAL", "10"))
+TCP_KEEPALIVE_COUNT = int(os.getenv("TCP_KEEPALIVE_COUNT", "3"))
+ACK_WINDOW = int(os.getenv("ACK_WINDOW", "128"))
+ACK_TIMEOUT = float(os.getenv("ACK_TIMEOUT", "30"))
+SESSION_CIPHERS = [name for name in os.getenv("SESSION_CIPHERS", "").split(",") if name]
+CONTROL_ENABLED = os.getenv("CONTROL_ENABLED", "false").lower() == "true"
+CONTROL_HOST = os.getenv("CONTROL_HOST", "127.0.0.1")
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "12346"))
+CONTROL_TOKEN = os.getenv("CONTROL_TOKEN")
+CONTROL_MAX_BODY_SIZE = int(os.getenv("CONTROL_MAX_BODY_SIZE", str(MAX_BODY_SIZE)))
+REPLAY_MAX_MESSAGES = int(os.getenv("REPLAY_MAX_MESSAGES", "100"))
+CLIENT_EXPIRY_DAYS = float(os.getenv("CLIENT_EXPIRY_DAYS", "30"))
+CLIENT_EXPIRY_INTERVAL = float(os.getenv("CLIENT_EXPIRY_INTERVAL", "3600"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+CLIENT_NAME_ATTEMPTS = 3
+# Threads besides the DB workers that may hold a connection at the same time: the menu, the catch-up sync, the message
+# log flusher and compactor, and client expiry. Control API requests come on top and are not bounded.
+BACKGROUND_DB_THREADS = 5
+SSN_LOOKUP_BATCH = 500
+
+# Retrying a stale roster sync could undo newer changes; clients that missed one are caught up by the next sync instead.
+RETRYABLE_ACTIONS = ("SAVE", "DELETE")
+# A client that fails to apply one of these has an unknown roster, so its next sync starts over with a snapshot.
+SYNC_ACTIONS = ("SYNC", "SNAPSHOT_END", "DELETE_ALL")
+# Marks a reconnecting client whose missed messages can't be replayed, so it is caught up with a sync instead.
+CATCH_UP_SYNC = "sync"
+
+event_loop = None
+# In a worker process, the channel to the coordinator; in the coordinator, one channel per worker process.
+coordinator = None
+workers = []
+worker_stopped = threading.Event()
+client_expiry_stopped = threading.Event()
+client_name_lock = threading.Lock()
+next_client_number = None
+operation_id_lock = threading.Lock()
+next_operation_number = None
+sync_lock = threading.Lock()
+catch_up_lock = threading.Lock()
+catch_up_clients = set()
+send_order_lock = threading.Lock()
+# The handle_client tasks still running, so shutdown can wait for their cleanup.
+client_tasks = set()
+compressor = Compressor(COMPRESSION, COMPRESSION_THRESHOLD)
+
+metrics = MetricsRegistry("personnel_server_")
+connections_accepted = metrics.counter("connections_accepted", "TCP connections accepted.")
+clients_evicted = metrics.counter("clients_evicted", "Clients evicted for missing heartbeats.")
+handshake_seconds = metrics.histogram("handshake_seconds", "Time from accepting a connection until the client is registered.")
+registration_seconds = metrics.histogram("registration_seconds", "Time to allocate a client name and insert the client row.")
+registration_failures = metrics.counter("registration_failures", "Clients that could not be registered.")
+db_query_seconds = metrics.histogram("db_query_seconds", "Time to execute one database statement.")
+db_commit_seconds = metrics.histogram("db_commit_seconds", "Time to flush and commit one database session.")
+encrypt_seconds = metrics.histogram("encrypt_seconds", "Time to encrypt one outgoing frame.", ["cipher"])
+send_seconds = metrics.histogram("send_seconds", "Time a frame spent queued and being written to one client.")
+frames_sent = metrics.counter("frames_sent", "Frames written to clients.")
+bytes_sent = metrics.counter("bytes_sent", "Bytes written to clients.")
+replayed_messages = metrics.counter("replayed_messages", "Missed messages replayed to reconnecting clients.")
+messages_compacted = metrics.counter("messages_compacted", "Message log rows deleted by retention.")
+payloads_compacted = metrics.counter("payloads_compacted", "Stored payloads deleted once no message log row referred to them.")
+compaction_seconds = metrics.histogram("compaction_seconds", "Time to run one message log compaction.")
+catch_up_syncs = metrics.counter("catch_up_syncs", "Reconnecting clients too far behind to replay, caught up with a sync instead.")
+clients_expired = metrics.counter("clients_expired", "Clients with an identity deleted after staying away longer than CLIENT_EXPIRY_DAYS.")
+broadcast_seconds = metrics.histogram("broadcast_seconds", "Time from submitting a broadcast until every recipient's send finished.", ["action"])
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+catch_up_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catch-up")
+
+connection_string = os.getenv("DATABASE_URL") or f"mysql+mysqlconnector://{MYSQL_USERNAME}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
+
+# The pool is shared by the DB workers, the background threads and control API requests; main() warns when it can't
+# cover the first two, and any checkout beyond it waits up to DB_POOL_TIMEOUT.
+engine = create_engine(
+    connection_string,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+pool_monitor = PoolMonitor(engine)
+
+# Loaded rows stay readable after the session closes, so sessions can end before any network I/O.
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+watch_queries(engine, Session, db_query_seconds, db_commit_seconds)
+Base = declarative_base()
 
-connection_string = f"mysql+mysqlconnector://{MYSQL_USERNAME}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
+@contextmanager
+def session_scope():
+    session = Session()
 
-engine = create_engine(connection_string)
-Session = sessionmaker(bind=engine)
-Base = declarative_base()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 class Client(Base):
     __tablename__ = 'clients'
+    __table_args__ = (
+        Index('clients_name', 'name', unique=True),
+        Index('clients_host_port', 'host', 'port'),
+        Index('clients_uid', 'uid', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     host = Column(String(100), nullable=False)
     port = Column(Integer, nullable=False)
+    # Clients that persist an identity keep their row, name and message history across reconnects.
+    uid = Column(String(32))
+    # When a client with an identity last registered or disconnected; clients away too long are expired.
+    last_seen = Column(DateTime)
 
     messages = relationship("Message", back_populates="client")
 
@@ -47,134 +206,1162 @@ class Client(Base):
 
 class Personnel(Base):
     __tablename__ = 'personnel'
+    __table_args__ = (
+        Index('personnel_ssn', 'ssn', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     surname = Column(String(100), nullable=False)
-    ssn = Column(String(11), nullable=False, unique=True)
+    ssn = Column(String(11), nullable=False)
 
     def __repr__(self):
         return f"<Personnel(name={self.name}, surname={self.surname}, ssn={self.ssn})>"
 
+class PersonnelChange(Base):
+    __tablename__ = 'personnel_changes'
+
+    # The id of the latest change is the roster revision clients sync against.
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ssn = Column(String(11), nullable=False)
+    operation = Column(String(6), nullable=False)
+    name = Column(String(100))
+    surname = Column(String(100))
+
+    def __repr__(self):
+        return f"<PersonnelChange(id={self.id}, operation={self.operation}, ssn={self.ssn})>"
+
+class Payload(Base):
+    __tablename__ = 'payloads'
+
+    # The SHA-256 of the payload, so a message broadcast to many clients is stored once.
+    hash = Column(String(64), primary_key=True)
+    payload = Column(JSON, nullable=False)
+
+    def __repr__(self):
+        return f"<Payload(hash={self.hash})>"
+
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('messages_client_id', 'client_id'),
+        Index('messages_operation_id', 'operation_id', 'client_id'),
+        Index('messages_client_operation', 'client_id', 'operation_id'),
+        Index('messages_payload_hash', 'payload_hash'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
-    payload = Column(JSON, nullable=False)
+    payload_hash = Column(String(64), ForeignKey('payloads.hash'), nullable=False)
+    # The id the client acknowledges; one operation is logged once per recipient.
+    operation_id = Column(Integer)
+    status = Column(String(8))
+    latency_ms = Column(Float)
+    # NULL on rows logged before the column was added by migrate_database.py.
+    created_at = Column(DateTime)
 
     client = relationship("Client", back_populates="messages")
+    payload = relationship("Payload")
 
     def __repr__(self):
-        return f"<Message(id={self.id}, client_id={self.client_id}, payload={self.payload})>"
+        return f"<Message(id={self.id}, client_id={self.client_id}, payload_hash={self.payload_hash})>"
+
+def record_compaction(rows, payloads, elapsed):
+    messages_compacted.inc(rows)
+    payloads_compacted.inc(payloads)
+    compaction_seconds.observe(elapsed)
+    if rows:
+        logger.info("Compacted the message log: %d rows and %d payloads deleted in %.1fs", rows, payloads, elapsed)
+
+message_log = MessageLogWriter(
+    Session,
+    Message,
+    Payload,
+    flush_size=MESSAGE_LOG_FLUSH_SIZE,
+    flush_interval=MESSAGE_LOG_FLUSH_INTERVAL,
+    background=MESSAGE_LOG_BACKGROUND,
+    retention_age=MESSAGE_RETENTION_DAYS * 86400,
+    retention_rows=MESSAGE_RETENTION_ROWS,
+    retention_interval=MESSAGE_RETENTION_INTERVAL,
+    batch_size=MESSAGE_RETENTION_BATCH_SIZE,
+    on_compact=record_compaction,
+)
+
+def get_roster_revision(session):
+    return session.query(func.max(PersonnelChange.id)).scalar() or 0
+
+def load_personnel_records(session, ssns):
+    records = {}
+
+    for start in range(0, len(ssns), SSN_LOOKUP_BATCH):
+        batch = ssns[start:start + SSN_LOOKUP_BATCH]
+        for personnel in session.query(Personnel).filter(Personnel.ssn.in_(batch)):
+            records[personnel.ssn] = PersonnelRecord(personnel.id, personnel.name, personnel.surname, personnel.ssn)
+
+    return records
+
+delivery_tracker = DeliveryTracker(ACK_WINDOW, ACK_TIMEOUT, message_log.update_status)
+
+personnel_cache = PersonnelCache(
+    get_roster_revision,
+    load_personnel_records,
+    ttl=PERSONNEL_CACHE_TTL,
+    check_interval=PERSONNEL_CACHE_CHECK_INTERVAL,
+)
+
+def local_connections():
+    # In worker mode the coordinator's registry only holds RemoteConnections; the sockets live in the workers.
+    return [connection for connection in connected_clients.snapshot() if isinstance(connection, ClientConnection)]
+
+metrics.gauge("connected_clients", "Open client connections, including ones still in the handshake.", lambda: len(local_connections()))
+metrics.gauge(
+    "outbound_queue_frames", "Frames waiting in client outbound queues.",
+    lambda: sum(connection.queue.qsize() for connection in local_connections())
+)
+metrics.gauge(
+    "outbound_queue_max_frames", "Frames waiting in the fullest client outbound queue.",
+    lambda: max((connection.queue.qsize() for connection in local_connections()), default=0)
+)
+metrics.gauge("deliveries_outstanding", "Deliveries sent but not yet acknowledged.", delivery_tracker.outstanding)
+metrics.gauge("message_log_pending", "Message log rows and status updates waiting to be written.", message_log.pending)
+metrics.gauge("db_connections_checked_out", "Database connections currently checked out of the pool.", lambda: pool_monitor.checked_out)
+
+def find_highest_client_number(session):
+    highest_number = session.query(func.max(Client.id)).scalar() or 0
+
+    for (client_name,) in session.query(Client.name).filter(Client.name.like("Client #%")):
+        number = client_name[len("Client #"):]
+        if number.isdigit():
+            highest_number = max(highest_number, int(number))
+
+    return highest_number
 
 def get_next_client_name(session):
-    try:
-        max_id = session.query(func.max(Client.id)).scalar()
+    global next_client_number
 
-        if max_id is None:
-            return "Client #1"
+    # Names come from an in-memory sequence seeded once from the database, so allocating one costs no query.
+    with client_name_lock:
+        if next_client_number is None:
+            next_client_number = find_highest_client_number(session) + 1
 
-        next_id = max_id + 1
-        existing_client = session.query(Client).filter_by(id=next_id).first()
+        client_number = next_client_number
+        next_client_number += 1
 
-        if existing_client is None:
-            return f"Client #{next_id}"
+    return f"Client #{client_number}"
+
+def reset_client_names():
+    global next_client_number
+
+    with client_name_lock:
+        next_client_number = None
+
+def next_operation_id():
+    global next_operation_number
+
+    # Like client names, operation ids come from an in-memory sequence seeded once from the database.
+    with operation_id_lock:
+        if next_operation_number is None:
+            with session_scope() as session:
+                next_operation_number = (session.query(func.max(Message.operation_id)).scalar() or 0) + 1
+
+        operation_id = next_operation_number
+        next_operation_number += 1
+
+    return operation_id
+
+def prepare_message(message):
+    message["id"] = next_operation_id()
+    return message["id"], json.dumps(message)
+
+def encode_payload(message_json, encoding, compression, encoded):
+    if encoding not in encoded:
+        if encoding == ENCODING_COMPACT:
+            encoded[encoding] = (encode_compact(json.loads(message_json)), FLAG_COMPACT)
+        else:
+            encoded[encoding] = (message_json.encode(), 0)
+
+    payload, flags = encoded[encoding]
+    payload, compression_flag = compressor.compress(payload, compression)
+    return payload, flags | compression_flag
+
+def encode_frames(message_json, connections):
+    encoded = {}
+    payloads = {}
+    frames = {}
+
+    # Each wire format in use is serialized and compressed once. Fernet clients share the key, so one token serves them all;
+    # clients with a session cipher get their own, much cheaper, encryption of the same payload.
+    for connection in connections:
+        if connection.frame_key in frames:
+            continue
+
+        wire_format = connection.wire_format
+        if wire_format not in payloads:
+            payloads[wire_format] = encode_payload(message_json, *wire_format, encoded)
+        payload, flags = payloads[wire_format]
+
+        start = time.perf_counter()
+        if connection.session_cipher is None:
+            token = fernet.encrypt(payload)
+            cipher = "fernet"
         else:
-            while True:
-                next_id += 1
-                existing_client = session.query(Client).filter_by(id=next_id).first()
-                if existing_client is None:
-                    return f"Client #{next_id}"
+            token = connection.session_cipher.encrypt(payload, MESSAGE_TYPE_DATA, flags)
+            cipher = connection.session_cipher.name
+        encrypt_seconds.labels(cipher).observe(time.perf_counter() - start)
+        frames[connection.frame_key] = encode_frame(token, flags=flags)
+
+    return frames
+
+def record_send(elapsed, size):
+    send_seconds.observe(elapsed)
+    frames_sent.inc()
+    bytes_sent.inc(size)
+
+def submit_broadcast(message_json, clients, operation_id=None, action=None, retry=False):
+    start = time.perf_counter()
+    connections = []
+    missing = {}
+    tracked = {}
+    failed = []
+
+    for client in clients:
+        connection = connected_clients.get_by_id(client.id)
+        address = (client.host, client.port)
+
+        if connection is None:
+            missing[address] = "not connected"
+            failed.append((client.id, "not connected"))
+            continue
+
+        # Clients that acknowledge messages may only have ACK_WINDOW of them unacknowledged at a time. A client
+        # that is not keeping up fails this delivery, to be retried, rather than holding up the other recipients.
+        if operation_id is not None and connection.acks:
+            if not delivery_tracker.has_room(client.id):
+                missing[address] = "in-flight window full"
+                failed.append((client.id, "in-flight window full"))
+                continue
+            tracked[address] = client.id
+
+        connections.append(connection)
+
+    if operation_id is not None:
+        delivery_tracker.track(operation_id, list(tracked.values()) + [client_id for client_id, _ in failed], action, message_json, retry)
+        for client_id, reason in failed:
+            delivery_tracker.fail(operation_id, client_id, reason)
+
+    if workers:
+        future = route_broadcast(message_json, connections, missing)
+    else:
+        # Clients reject session cipher frames whose nonce counter goes backwards, so frames are queued in the order
+        # they were encrypted even when several threads broadcast at once.
+        with send_order_lock:
+            frames = encode_frames(message_json, connections)
+            future = asyncio.run_coroutine_threadsafe(broadcast(connections, frames, SLOW_SEND_THRESHOLD, missing, record_send), event_loop)
+
+    # Snapshot chunks and other unacknowledged messages are grouped under "other".
+    broadcast_time = broadcast_seconds.labels(action or "other")
+    future.add_done_callback(lambda future: broadcast_time.observe(time.perf_counter() - start))
+
+    if tracked:
+        def record_failed_sends(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            failed = future.result().failed
+            for address, reason in failed.items():
+                if address in tracked:
+                    delivery_tracker.fail(operation_id, tracked[address], reason)
+            delivery_tracker.mark_written(operation_id, [client_id for address, client_id in tracked.items() if address not in failed])
+
+        future.add_done_callback(record_failed_sends)
+
+    return future
+
+def broadcast_message(message_json, clients, operation_id=None, action=None):
+    return submit_broadcast(message_json, clients, operation_id, action).result()
+
+def broadcast_messages(messages, retry=False):
+    reports = []
+
+    # Broadcasts are pipelined in windows no larger than half a client's outbound queue, leaving room for other senders.
+    window = max(1, OUTBOUND_QUEUE_SIZE // 2)
+    for start in range(0, len(messages), window):
+        futures = [
+            submit_broadcast(message_json, clients, operation_id, action, retry)
+            for message_json, clients, operation_id, action in messages[start:start + window]
+        ]
+        reports.extend(future.result() for future in futures)
+
+    return reports
+
+def register_client(client_host, client_port, uid=None):
+    start = time.perf_counter()
+    session = Session()
+
+    try:
+        for _ in range(CLIENT_NAME_ATTEMPTS):
+            if uid is not None:
+                client = session.query(Client).filter_by(uid=uid).first()
+                if client is not None:
+                    client.host = client_host
+                    client.port = client_port
+                    client.last_seen = datetime.now()
+                    session.commit()
+                    return client.id, client.name, True
+
+            client_name = get_next_client_name(session)
+
+            new_client = Client(name=client_name, host=client_host, port=client_port, uid=uid, last_seen=datetime.now())
+
+            session.add(new_client)
+            try:
+                session.flush()
+            except IntegrityError:
+                # Another writer took the name, or the same client registered on another connection;
+                # reseed the sequence from the database and try again.
+                session.rollback()
+                reset_client_names()
+                continue
+
+            client_id = new_client.id
+            session.commit()
+            return client_id, client_name, False
+
+        logger.error("Could not allocate a unique name for client %s:%s", client_host, client_port)
+        registration_failures.inc()
+        return None
+
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error("Error occurred while adding client to the database: %s", e)
+        registration_failures.inc()
+        return None
+    finally:
+        session.close()
+        registration_seconds.observe(time.perf_counter() - start)
+
+def unregister_client(client_host, client_port):
+    try:
+        with session_scope() as session:
+            # Clients with an identity keep their row, so they are caught up when they come back.
+            session.query(Client).filter_by(host=client_host, port=client_port, uid=None).delete()
+            session.query(Client).filter(Client.host == client_host, Client.port == client_port, Client.uid.isnot(None)).update(
+                {Client.last_seen: datetime.now()}, synchronize_session=False
+            )
 
     except SQLAlchemyError as e:
-        print(f"Error occurred while getting next client name: {e}")
+        logger.error("Error occurred while removing client from the database: %s", e)
+
+def expire_clients():
+    # Clients with an identity keep their row and log while away; once away longer than CLIENT_EXPIRY_DAYS they are
+    # deleted, so broadcasts stop logging for them. One that still comes back registers anew and gets a snapshot.
+    cutoff = datetime.now() - timedelta(days=CLIENT_EXPIRY_DAYS)
+    connected_ids = [connection.client_id for connection in connected_clients.snapshot() if connection.client_id is not None]
+
+    expired = message_log.delete_clients(
+        Client,
+        Client.uid.isnot(None),
+        or_(Client.last_seen.is_(None), Client.last_seen < cutoff),
+        Client.id.notin_(connected_ids)
+    )
+    if expired:
+        clients_expired.inc(len(expired))
+        logger.info("Expired %d clients not seen for %g days", len(expired), CLIENT_EXPIRY_DAYS)
+    return expired
+
+def delete_anonymous_clients():
+    # Clients without an identity are registered anew on every connection, so at startup none of their rows can belong
+    # to a live connection; rows left behind by a crash would otherwise be logged for and reported as not connected.
+    deleted = message_log.delete_clients(Client, Client.uid.is_(None))
+    if deleted:
+        logger.info("Deleted %d clients left over from the last run", len(deleted))
+
+def run_client_expiry():
+    while not client_expiry_stopped.wait(CLIENT_EXPIRY_INTERVAL):
+        expire_clients()
+
+def load_missed_messages(session, client_id, last_message_id, gap_ids=()):
+    # Replays stay within one ack window and half an outbound queue; a client further behind gets a sync instead.
+    limit = min(REPLAY_MAX_MESSAGES, ACK_WINDOW, max(1, OUTBOUND_QUEUE_SIZE // 2))
+
+    # Retention deletes the oldest rows first; a client whose last message is gone may have missed deleted ones too.
+    oldest = session.query(func.min(Message.operation_id)).scalar()
+    if last_message_id and (oldest is None or last_message_id < oldest):
         return None
 
-def send_message_to_client(message_json, client_host, client_port):
+    rows = (
+        session.query(Message.operation_id, Payload.payload)
+        .join(Payload, Payload.hash == Message.payload_hash)
+        .filter(Message.client_id == client_id, or_(Message.operation_id > last_message_id, Message.operation_id.in_(gap_ids)))
+        .order_by(Message.operation_id)
+        .limit(limit + 1)
+        .all()
+    )
+    if len(rows) > limit:
+        return None
 
-    for client_ip, client_port_number, client_socket in connected_clients:
-        if client_ip == client_host and client_port_number == client_port:
-            try:
-                encrypted_message = fernet.encrypt(message_json.encode())
-                client_socket.send(encrypted_message)
-                print(f"Message sent successfully to {client_host}:{client_port}")
+    # A gap that is no longer logged can't be replayed.
+    if len({operation_id for operation_id, _ in rows} & set(gap_ids)) < len(gap_ids):
+        return None
 
-            except Exception as e:
-                print(f"Error sending message to {client_host}:{client_port}: {e}")    
+    missed = []
+    for operation_id, message_json in rows:
+        action = json.loads(message_json)["action"]
+        # A snapshot's chunks aren't logged with an id, so a missed snapshot can only be sent again in full.
+        if action == "SNAPSHOT_END":
+            return None
+        missed.append((operation_id, action, message_json))
 
-def accept_connections(server_socket):
-    while True:
-        client_socket, client_address = server_socket.accept()
+    return missed
 
-        client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
-        client_thread.start()
+def register_client_with_catch_up(client_host, client_port, uid=None, last_message_id=None, acks=False):
+    registration = register_client(client_host, client_port, uid)
+    if registration is None:
+        return None
 
-def handle_client(client_socket, client_address):
+    client_id, client_name, returning = registration
+    if uid is None or last_message_id is None:
+        return client_id, client_name, None
 
-    client_host = client_address[0]
-    client_port = client_address[1]
+    # A client that has applied messages but whose row expired, or was never here, has no log to replay from.
+    if not returning and last_message_id:
+        catch_up_syncs.inc()
+        return client_id, client_name, CATCH_UP_SYNC
 
-    print(f"New connection from {client_host}:{client_port}")
-    connected_clients.append((client_address[0], client_address[1], client_socket))
+    # Whatever the old connection still had in flight is either applied or about to be replayed, together with
+    # older failures that never reached the client.
+    gaps = delivery_tracker.reconnect_client(client_id, last_message_id)
+    message_log.flush()
 
-    session = Session()
+    if any(gap.action not in RETRYABLE_ACTIONS for gap in gaps):
+        missed = None
+    else:
+        try:
+            with session_scope() as session:
+                missed = load_missed_messages(session, client_id, last_message_id, [gap.operation_id for gap in gaps])
+        except (SQLAlchemyError, ValueError, KeyError) as e:
+            logger.error("Error occurred while loading missed messages for %s: %s", client_name, e)
+            missed = None
+
+    if missed is None:
+        catch_up_syncs.inc()
+        return client_id, client_name, CATCH_UP_SYNC
+
+    if acks:
+        for operation_id, action, message_json in missed:
+            delivery_tracker.track(operation_id, [client_id], action, message_json, retry=True)
+    replayed_messages.inc(len(missed))
+    return client_id, client_name, missed
+
+def apply_catch_up_state(connection, catch_up):
+    # Sets the roster state the client will be in once it has applied what it is sent on reconnect.
+    if catch_up == CATCH_UP_SYNC:
+        connection.sync_revision = None
+        connection.snapshot_progress = None
+        return
+
+    for _, action, message_json in catch_up or ():
+        if action == "SYNC":
+            connection.sync_revision = json.loads(message_json)["revision"]
+            connection.snapshot_progress = None
+        elif action == "DELETE_ALL":
+            connection.sync_revision = 0
+            connection.snapshot_progress = None
+        elif action in RETRYABLE_ACTIONS:
+            connection.sync_revision = None
+            connection.snapshot_progress = None
+
+def request_catch_up(client_id):
+    # Clients reconnecting together after a restart are caught up by one sync rather than one each.
+    with catch_up_lock:
+        submit = not catch_up_clients
+        catch_up_clients.add(client_id)
+
+    if submit:
+        catch_up_executor.submit(run_catch_up)
+
+def run_catch_up():
+    with catch_up_lock:
+        client_ids = set(catch_up_clients)
+        catch_up_clients.clear()
 
     try:
-        client_name = get_next_client_name(session)
+        _, _, _, reports = sync_all_personnel(client_ids)
+        for label, report in reports:
+            logger.info("Caught up %d reconnected client(s), %s: %s", len(client_ids), label, report.summary())
+    except SQLAlchemyError as e:
+        logger.error("Error occurred while catching up reconnected clients: %s", e)
 
-        new_client = Client(name=client_name, host=client_host, port=client_port)
+async def read_hello(reader):
+    try:
+        frame = await asyncio.wait_for(read_frame_async(reader), HANDSHAKE_TIMEOUT)
+    except (asyncio.TimeoutError, ProtocolError, ConnectionError):
+        return None
 
-        session.add(new_client)
-        session.commit()
+    if frame is None or frame.message_type != MESSAGE_TYPE_HELLO:
+        return None
 
-        while True:
+    try:
+        return json.loads(fernet.decrypt(frame.payload))
+    except (InvalidToken, ValueError):
+        return None
+
+async def start_session_cipher(connection, hello):
+    name = choose_cipher(hello.get("ciphers"), SESSION_CIPHERS)
+    if name is None:
+        return True
+
+    try:
+        client_nonce = bytes.fromhex(hello["nonce"])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    # The welcome is the last Fernet frame; every DATA frame after it, and every ack back, uses the session keys.
+    server_nonce = new_handshake_nonce()
+    welcome = {"cipher": name, "nonce": server_nonce.hex()}
+    connection.session_cipher = SessionCipher(name, key, client_nonce, server_nonce)
+    connection.receive_cipher = SessionCipher(name, key, client_nonce, server_nonce, DIRECTION_TO_SERVER)
+
+    try:
+        await connection.enqueue(encode_frame(fernet.encrypt(json.dumps(welcome).encode()), MESSAGE_TYPE_WELCOME))
+    except DeliveryError:
+        return False
+    return True
+
+def record_replay_written(client_id, operation_id, future):
+    if future.cancelled() or future.exception() is not None:
+        return
+
+    if coordinator is not None:
+        coordinator.notify("written", client_id, operation_id)
+    else:
+        delivery_tracker.mark_written(operation_id, [client_id])
+
+def handle_ack(connection, frame):
+    try:
+        if connection.receive_cipher is not None:
+            payload = connection.receive_cipher.decrypt(frame.payload, frame.message_type, frame.flags)
+        else:
+            payload = fernet.decrypt(frame.payload)
+        ack = json.loads(payload)
+    except (InvalidTag, InvalidToken, ValueError):
+        logger.warning("Invalid ack from %s:%s", connection.host, connection.port)
+        return
+
+    if coordinator is not None:
+        coordinator.notify("ack", connection.client_id, ack)
+    else:
+        apply_ack(connection, ack)
+
+def apply_ack(connection, ack):
+    error = ack.get("error")
+    delivery = delivery_tracker.ack(connection.client_id, ack.get("id"), ack.get("rows", 0), ack.get("apply_ms"), error)
+
+    if delivery is not None and error:
+        logger.warning("%s failed to apply %s %s: %s", connection.client_name, delivery.action, delivery.operation_id, error)
+        if delivery.action in SYNC_ACTIONS:
+            connection.sync_revision = None
+            connection.snapshot_progress = None
+
+PING_FRAME = encode_frame(b"", MESSAGE_TYPE_PING)
+
+def configure_keepalive(sock):
+    # The kernel probes idle peers and gives up on unacknowledged data, so a powered-off host is noticed
+    # even by clients that don't answer heartbeats. The fine-grained options are Linux-only.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    for option, value in (
+        ("TCP_KEEPIDLE", TCP_KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", TCP_KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", TCP_KEEPALIVE_COUNT),
+        ("TCP_USER_TIMEOUT", int(HEARTBEAT_TIMEOUT * 1000)),
+    ):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+async def run_heartbeats(connection):
+    while not connection.closed:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+        idle = time.monotonic() - connection.last_seen
+        if idle > HEARTBEAT_TIMEOUT:
+            # Aborting ends handle_client's read, which removes the client from the registry and the database.
+            logger.warning(
+                "Evicting %s %s:%s: no response for %.0fs", connection.client_name or "client", connection.host, connection.port, idle
+            )
+            clients_evicted.inc()
+            connection.close(abort=True)
+            return
+
+        connection.post(PING_FRAME)
+
+async def register_connection(connection, hello):
+    uid = hello.get("uid")
+    last_message_id = hello.get("last_message_id")
+
+    if coordinator is None:
+        return await asyncio.get_running_loop().run_in_executor(
+            db_executor, register_client_with_catch_up, connection.host, connection.port, uid, last_message_id, connection.acks
+        )
+
+    # Workers leave the database and delivery tracking to the coordinator, which keeps its own view of the client.
+    state = {
+        "revision": connection.sync_revision,
+        "snapshot": connection.snapshot_progress,
+        "acks": connection.acks,
+        "uid": uid,
+        "last_message_id": last_message_id,
+    }
+    try:
+        return await asyncio.wrap_future(coordinator.request("register", connection.host, connection.port, state))
+    except ChannelClosed:
+        return None
+
+async def handle_client(reader, writer):
+    client_tasks.add(asyncio.current_task())
+
+    client_address = writer.get_extra_info("peername")
+    client_host = client_address[0]
+    client_port = client_address[1]
+
+    accepted_at = time.perf_counter()
+    connections_accepted.inc()
+    logger.debug("New connection from %s:%s", client_host, client_port)
+    configure_keepalive(writer.get_extra_info("socket"))
+    connection = ClientConnection(client_host, client_port, writer, OUTBOUND_QUEUE_SIZE, SEND_TIMEOUT)
+    connection.start()
+    connected_clients.add(connection)
+
+    loop = asyncio.get_running_loop()
+    heartbeat_task = None
+
+    try:
+        hello = await read_hello(reader)
+        if hello is None:
+            logger.warning("Client %s:%s did not complete the handshake", client_host, client_port)
+            return
+
+        connection.sync_revision = hello.get("revision", 0)
+        connection.snapshot_progress = hello.get("snapshot")
+        connection.encoding = choose_encoding(hello.get("encodings"))
+        connection.compression = compressor.choose(hello.get("compressions"))
+        connection.acks = bool(hello.get("acks"))
+
+        if not await start_session_cipher(connection, hello):
+            logger.warning("Client %s:%s did not complete the handshake", client_host, client_port)
+            return
+
+        registration = await register_connection(connection, hello)
+        if registration is not None:
+            client_id, client_name, catch_up = registration
+
+            previous = connected_clients.get_by_id(client_id)
+            if previous is not None:
+                # The client reconnected before its old connection was noticed as dead.
+                connected_clients.remove(previous)
+                previous.close(abort=True)
+
+            # Missed messages are queued before the connection is bound, so no newer broadcast can overtake them.
+            if catch_up and catch_up != CATCH_UP_SYNC:
+                for operation_id, _, message_json in catch_up:
+                    future = connection.enqueue(encode_frames(message_json, [connection])[connection.frame_key])
+                    future.add_done_callback(partial(record_replay_written, client_id, operation_id))
+            apply_catch_up_state(connection, catch_up)
+
+            connected_clients.bind(connection, client_id, client_name)
+            handshake_seconds.observe(time.perf_counter() - accepted_at)
+
+            if catch_up == CATCH_UP_SYNC:
+                if coordinator is not None:
+                    coordinator.notify("ready", client_id)
+                else:
+                    request_catch_up(client_id)
+
+            if hello.get("heartbeats"):
+                connection.last_seen = time.monotonic()
+                heartbeat_task = asyncio.create_task(run_heartbeats(connection))
+
+        while registration is not None:
             try:
-                data = client_socket.recv(1)
-                if not data:
-                    print(f"Client {client_host}:{client_port} disconnected")
+                frame = await read_frame_async(reader)
+                if frame is None:
+                    logger.debug("Client %s:%s disconnected", client_host, client_port)
                     break
+            except ProtocolError as e:
+                logger.warning("Invalid frame from %s:%s: %s", client_host, client_port, e)
+                break
             except ConnectionResetError:
                 break
 
-    except SQLAlchemyError as e:
-        session.rollback()
-        print(f"Error occurred while adding client to the database: {e}")
+            # Any frame proves the client is alive; PONGs need no further handling.
+            connection.last_seen = time.monotonic()
+
+            if frame.message_type == MESSAGE_TYPE_ACK:
+                handle_ack(connection, frame)
+
     finally:
-        session.close()
-        client_socket.close()
-        connected_clients.remove((client_address[0], client_address[1], client_socket))
-        print(f"Connection with {client_address} closed.")
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        # A connection replaced by the client's reconnect no longer owns the client's deliveries or row.
+        replaced = connection.client_id is not None and connected_clients.get_by_id(connection.client_id) is not connection
+        connected_clients.remove(connection)
+        connection.close()
+        logger.debug("Connection with %s closed.", client_address)
+
+        if coordinator is not None:
+            if connection.client_id is not None and not replaced:
+                coordinator.notify("closed", connection.client_id, client_host, client_port)
+        elif not replaced:
+            if connection.client_id is not None:
+                delivery_tracker.drop_client(connection.client_id)
+            await loop.run_in_executor(db_executor, unregister_client, client_host, client_port)
+        client_tasks.discard(asyncio.current_task())
+
+def start_server_loop(reuse_port=False):
+    global event_loop
+
+    event_loop = asyncio.new_event_loop()
+    server = event_loop.run_until_complete(
+        asyncio.start_server(handle_client, SERVER_HOST, SERVER_PORT, backlog=SERVER_BACKLOG, reuse_port=reuse_port or None)
+    )
+
+    loop_thread = threading.Thread(target=event_loop.run_forever, name="event-loop", daemon=True)
+    loop_thread.start()
+
+    return server
+
+def stop_server_loop(server):
+    async def shutdown():
+        server.close()
+        for connection in connected_clients.snapshot():
+            connection.close(abort=True)
+        await server.wait_closed()
+        # Each handler unregisters its client on the way out; the loop must not stop before they have.
+        if client_tasks:
+            await asyncio.wait(set(client_tasks), timeout=SEND_TIMEOUT)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), event_loop).result(2 * SEND_TIMEOUT)
+    event_loop.call_soon_threadsafe(event_loop.stop)
+
+def handle_coordinator_message(channel, kind, request_id, args):
+    # Runs in a worker on the channel's reader thread, which encrypts broadcasts off the event loop like the menu thread does.
+    if kind == "broadcast":
+        message_json, client_ids = args
+        connections = []
+        missing_ids = []
+        for client_id in client_ids:
+            connection = connected_clients.get_by_id(client_id)
+            if connection is None:
+                missing_ids.append(client_id)
+            else:
+                connections.append(connection)
+
+        frames = encode_frames(message_json, connections)
+        future = asyncio.run_coroutine_threadsafe(broadcast(connections, frames, SLOW_SEND_THRESHOLD, None, record_send), event_loop)
+
+        def send_report(future):
+            if future.cancelled() or future.exception() is not None:
+                channel.reply(request_id, error="broadcast did not complete")
+                return
+            report = future.result()
+            channel.reply(request_id, (report.delivered, report.slow, report.failed, missing_ids))
+
+        future.add_done_callback(send_report)
+    elif kind == "metrics":
+        channel.reply(request_id, metrics.collect())
+    elif kind == "drop":
+        connection = connected_clients.get_by_address(*args)
+        if connection is not None:
+            event_loop.call_soon_threadsafe(connection.close, True)
+    elif kind == "stop":
+        worker_stopped.set()
+
+def run_worker(number, pipe):
+    global coordinator
+
+    # Ctrl+C at the menu reaches the whole process group; workers are stopped by the coordinator instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # The coordinator's ends of every pipe were inherited too, this worker's own included; holding them would keep
+    # the workers from seeing EOF when the coordinator exits.
+    for worker in workers:
+        worker.close()
+    workers.clear()
+
+    coordinator = Channel(pipe, handle_coordinator_message, lambda channel: worker_stopped.set(), f"coordinator-{number}")
+    server = start_server_loop(reuse_port=True)
+    coordinator.start()
+
+    worker_stopped.wait()
+    stop_server_loop(server)
+
+def finish_remote_registration(channel, request_id, client_host, client_port, state, future):
+    registration = future.result()
+
+    if registration is not None:
+        client_id, client_name, catch_up = registration
+
+        # The client may have reconnected through another worker, which still holds the old connection.
+        previous = connected_clients.get_by_id(client_id)
+        if previous is not None:
+            connected_clients.remove(previous)
+            previous.closed = True
+            previous.worker.notify("drop", previous.host, previous.port)
+
+        connection = RemoteConnection(channel, client_host, client_port, state)
+        apply_catch_up_state(connection, catch_up)
+        connected_clients.add(connection)
+        connected_clients.bind(connection, client_id, client_name)
+
+    channel.reply(request_id, registration)
+
+def drop_remote_connection(connection):
+    connected_clients.remove(connection)
+    connection.closed = True
+    delivery_tracker.drop_client(connection.client_id)
+    db_executor.submit(unregister_client, connection.host, connection.port)
+
+def handle_worker_message(channel, kind, request_id, args):
+    if kind == "register":
+        client_host, client_port, state = args
+        future = db_executor.submit(
+            register_client_with_catch_up, client_host, client_port, state.get("uid"), state.get("last_message_id"), state.get("acks")
+        )
+        future.add_done_callback(partial(finish_remote_registration, channel, request_id, client_host, client_port, state))
+    elif kind == "ack":
+        client_id, ack = args
+        connection = connected_clients.get_by_id(client_id)
+        if connection is not None:
+            apply_ack(connection, ack)
+    elif kind == "closed":
+        client_id, client_host, client_port = args
+        connection = connected_clients.get_by_id(client_id)
+        if connection is not None and connection.address == (client_host, client_port):
+            drop_remote_connection(connection)
+    elif kind == "ready":
+        request_catch_up(args[0])
+    elif kind == "written":
+        client_id, operation_id = args
+        delivery_tracker.mark_written(operation_id, [client_id])
+
+def worker_exited(channel):
+    if worker_stopped.is_set():
+        return
+
+    logger.error("%s exited; dropping its clients", channel.name)
+    for connection in connected_clients.snapshot():
+        if connection.worker is channel:
+            drop_remote_connection(connection)
+
+def start_workers(count):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("SERVER_WORKERS needs SO_REUSEPORT, which this platform does not support")
+
+    # Workers are forked before any other thread starts, so they inherit the configuration but no thread state.
+    context = multiprocessing.get_context("fork")
+
+    for number in range(count):
+        parent_pipe, child_pipe = context.Pipe()
+        channel = Channel(parent_pipe, handle_worker_message, worker_exited, f"worker-{number}")
+        workers.append(channel)
+
+        channel.process = context.Process(target=run_worker, args=(number, child_pipe), name=f"worker-{number}", daemon=True)
+        channel.process.start()
+        child_pipe.close()
+
+    for channel in workers:
+        channel.start()
+
+def stop_workers():
+    worker_stopped.set()
+
+    for channel in workers:
+        channel.notify("stop")
+    for channel in workers:
+        channel.process.join(SEND_TIMEOUT)
+        if channel.process.is_alive():
+            channel.process.terminate()
+        channel.close()
+
+def route_broadcast(message_json, connections, missing):
+    # Each worker encrypts and sends to its own clients; their reports are merged as if one process had sent them all.
+    result = Future()
+    report = BroadcastReport()
+    report.failed.update(missing)
+
+    by_worker = {}
+    for connection in connections:
+        by_worker.setdefault(connection.worker, []).append(connection)
+
+    if not by_worker:
+        result.set_result(report)
+        return result
+
+    lock = threading.Lock()
+    remaining = [len(by_worker)]
+
+    def collect(worker_connections, future):
+        with lock:
+            try:
+                delivered, slow, failed, missing_ids = future.result()
+            except Exception as e:
+                for connection in worker_connections:
+                    report.failed[connection.address] = f"worker unavailable: {e}"
+            else:
+                report.delivered.extend(delivered)
+                report.slow.extend(slow)
+                report.failed.update(failed)
+                addresses = {connection.client_id: connection.address for connection in worker_connections}
+                for client_id in missing_ids:
+                    report.failed[addresses[client_id]] = "not connected"
 
-        try:
-            session.query(Client).filter_by(host=client_host, port=client_port).delete()
-            session.commit()
+            remaining[0] -= 1
+            finished = remaining[0] == 0
 
-        except SQLAlchemyError as e:
-            session.rollback()
-            print(f"Error occurred while removing client from the database: {e}")
+        if finished:
+            result.set_result(report)
+
+    for worker, worker_connections in by_worker.items():
+        future = worker.request("broadcast", message_json, [connection.client_id for connection in worker_connections])
+        future.add_done_callback(partial(collect, worker_connections))
+
+    return result
+
+def render_metrics():
+    collections = [metrics.collect()]
+
+    for channel in workers:
+        try:
+            collections.append(channel.request("metrics").result(SEND_TIMEOUT))
+        except Exception as e:
+            logger.warning("Could not collect metrics from %s: %s", channel.name, e)
+
+    return render_families(merge_families(collections))
+
+TABLES = ("clients", "personnel", "messages")
+
+def get_table_rows(table):
+    with session_scope() as session:
+        if table == "clients":
+            return [{"id": client.id, "name": client.name, "host": client.host, "port": client.port} for client in session.query(Client)]
+        if table == "personnel":
+            return [{"id": person.id, "name": person.name, "surname": person.surname, "ssn": person.ssn} for person in session.query(Personnel)]
+        if table == "messages":
+            rows = session.query(Message.id, Message.client_id, Payload.payload).join(Payload, Payload.hash == Message.payload_hash)
+            return [{"id": message_id, "client_id": client_id, "payload": payload} for message_id, client_id, payload in rows]
+    raise ValueError(f"unknown table {table}")
+
+def get_server_stats():
+    return {
+        "connected_clients": len(connected_clients),
+        "evicted_clients": clients_evicted.value,
+        "personnel_cache": personnel_cache.stats(),
+        "pool": pool_monitor.stats(),
+        "compression": compressor.stats(),
+        "deliveries": delivery_tracker.stats(),
+    }
 
 def display_table(table):
-    session = Session()
     if table == 1:
-        clients = session.query(Client).all()
         print("Clients:")
-        for client in clients:
-            print(f"ID: {client.id}, Name: {client.name}, Host: {client.host}, Port: {client.port}")
+        for client in get_table_rows("clients"):
+            print(f"ID: {client['id']}, Name: {client['name']}, Host: {client['host']}, Port: {client['port']}")
     elif table == 2:
-        personnel = session.query(Personnel).all()
         print("Personnel:")
-        for person in personnel:
-            print(f"ID: {person.id}, Name: {person.name}, Surname: {person.surname}, SSN: {person.ssn}")
+        for person in get_table_rows("personnel"):
+            print(f"ID: {person['id']}, Name: {person['name']}, Surname: {person['surname']}, SSN: {person['ssn']}")
     elif table == 3:
-        messages = session.query(Message).all()
         print("Messages:")
-        for message in messages:
-            print(f"ID: {message.id}, Client ID: {message.client_id}, Payload: {message.payload}")
+        for message in get_table_rows("messages"):
+            print(f"ID: {message['id']}, Client ID: {message['client_id']}, Payload: {message['payload']}")
+    elif table == 4:
+        stats = personnel_cache.stats()
+        print("Personnel cache:")
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+    elif table == 5:
+        stats = pool_monitor.stats()
+        print("Database connection pool:")
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+    elif table == 6:
+        stats = compressor.stats()
+        print("Compression:")
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+    elif table == 7:
+        stats = delivery_tracker.stats()
+        print("Deliveries:")
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+        for failure in delivery_tracker.failed_deliveries(limit=20):
+            print(f"Failed: operation {failure['operation_id']} ({failure['action']}) to client {failure['client_id']}: {failure['reason']}")
     else:
         print("Invalid number. Please enter a valid number.")
 
-    session.close()
+PushResult = namedtuple("PushResult", ["messages", "report", "missing_personnel", "missing_clients"])
+
+def build_personnel_message(action, personnel):
+    if action == "SAVE":
+        return {
+            "action": "SAVE",
+            "personnel": {
+                "name": personnel.name,
+                "surname": personnel.surname,
+                "ssn": personnel.ssn
+            }
+        }
+
+    return {
+        "action": "DELETE",
+        "personnel": {
+            "ssn": personnel.ssn
+        }
+    }
+
+def push_personnel(action, ssns, client_names=None):
+    # Sends one SAVE or DELETE per SSN to the named clients, or to every client when no names are given.
+    ssns = list(dict.fromkeys(ssns))
+
+    with session_scope() as session:
+        personnel = personnel_cache.get_many(session, ssns)
+
+        query = session.query(Client)
+        if client_names is not None:
+            query = query.filter(Client.name.in_(client_names))
+        clients = query.all() if personnel else []
+
+    missing_personnel = [ssn for ssn in ssns if ssn not in personnel]
+    missing_clients = []
+    if client_names is not None and personnel:
+        found_names = {client.name for client in clients}
+        missing_clients = [name for name in client_names if name not in found_names]
+
+    messages = []
+    if clients:
+        for ssn in ssns:
+            if ssn in personnel:
+                operation_id, message_json = prepare_message(build_personnel_message(action, personnel[ssn]))
+                messages.append((message_json, clients, operation_id, action))
+
+    client_ids = [client.id for client in clients]
+    message_log.log_many([(client_ids, message_json, operation_id) for message_json, _, operation_id, _ in messages])
+    report = merge_reports(broadcast_messages(messages))
+    mark_unsynced(report)
+
+    return PushResult(len(messages), report, missing_personnel, missing_clients)
+
+def sync_all_personnel(client_ids=None):
+    with sync_lock:
+        with session_scope() as session:
+            revision = personnel_cache.get_revision(session)
+            query = session.query(Client)
+            if client_ids is not None:
+                query = query.filter(Client.id.in_(client_ids))
+            all_clients = query.all()
+
+        # Clients that never synced, fell too far behind or are ahead of the log share one full snapshot.
+        clients_by_revision = {}
+        resuming = []
+        disconnected = 0
+        up_to_date = 0
+        for client in all_clients:
+            connection = connected_clients.get_by_id(client.id)
+            if connection is None:
+                disconnected += 1
+                continue
+
+            progress = connection.snapshot_progress
+            if progress is not None and 0 <= revision - progress["revision"] <= SYNC_MAX_CHANGES:
+                resuming.append((client, progress))
+                continue
+
+            client_revision = connection.sync_revision
+            if client_revision == revision and revision > 0:
+                up_to_date += 1
+                continue
+            if not client_revision or client_revision > revision or revision - client_revision > SYNC_MAX_CHANGES:
+                client_revision = None
+
+            clients_by_revision.setdefault(client_revision, []).append(client)
+
+        reports = []
+
+        # An interrupted snapshot is finished at its own revision and then caught up with a delta.
+        for client, progress in resuming:
+            report = stream_snapshot(
+                [client], progress["revision"], progress["snapshot_id"], progress["last_id"], progress["seq"] + 1
+            )
+            reports.append((f"Resumed snapshot for {client.name}", report))
+
+            if report.delivered and progress["revision"] < revision:
+                clients_by_revision.setdefault(progress["revision"], []).append(client)
+
+        for client_revision, clients in clients_by_revision.items():
+            if client_revision is None:
+                report = stream_snapshot(clients, revision)
+                reports.append((f"Snapshot at revision {revision}", report))
+                continue
+
+            with session_scope() as session:
+                message = build_delta_message(session, client_revision, revision)
+
+            operation_id, message_json = prepare_message(message)
+
+            message_log.log([client.id for client in clients], message_json, operation_id)
+            report = broadcast_message(message_json, clients, operation_id, message["action"])
+            mark_synced(report, revision)
+            reports.append((f"{message['action']} to revision {revision}", report))
+
+    return revision, disconnected, up_to_date, reports
+
+def clear_all_personnel():
+    operation_id, message_json = prepare_message({
+        "action": "DELETE_ALL"
+    })
+
+    with sync_lock:
+        with session_scope() as session:
+            all_clients = session.query(Client).all()
+
+        message_log.log([client.id for client in all_clients], message_json, operation_id)
+        report = broadcast_message(message_json, all_clients, operation_id, "DELETE_ALL")
+        mark_synced(report, 0)
+
+    return report
+
+def retry_failed_deliveries():
+    # Disconnected clients are left out; they are replayed what they missed from the message log when they reconnect.
+    connected_ids = {connection.client_id for connection in connected_clients.snapshot() if connection.client_id is not None}
+    failures = delivery_tracker.take_failed(RETRYABLE_ACTIONS, connected_ids)
+
+    operations = {}
+    for failure in failures:
+        operations.setdefault(failure.operation_id, (failure.action, failure.message_json, []))[2].append(failure.client_id)
+
+    client_ids = {failure.client_id for failure in failures}
+    with session_scope() as session:
+        clients = {client.id: client for client in session.query(Client).filter(Client.id.in_(client_ids))} if client_ids else {}
+
+    # Operations are resent in their original order with their original ids, so a late ack still matches.
+    messages = []
+    for operation_id in sorted(operations):
+        action, message_json, recipients = operations[operation_id]
+        recipients = [clients[client_id] for client_id in recipients if client_id in clients]
+        if recipients:
+            messages.append((message_json, recipients, operation_id, action))
+
+    retried = sum(len(recipients) for _, recipients, _, _ in messages)
+    report = merge_reports(broadcast_messages(messages, retry=True))
+    mark_unsynced(report)
+    return retried, len(failures) - retried, report
+
+def print_push_result(result):
+    for ssn in result.missing_personnel:
+        print(f"Personnel {ssn} not found.")
+    for client_name in result.missing_clients:
+        print(f"Client {client_name} not found.")
+    if result.messages:
+        print(result.report.summary())
 
 def send_specific_personnel_to_client():
     while True:
@@ -182,131 +1369,182 @@ def send_specific_personnel_to_client():
 
         client_name = input("Enter client's name: ")
 
-        session = Session()
-
         try:
-            personnel = session.query(Personnel).filter_by(ssn=ssn).first()
-            client = session.query(Client).filter_by(name=client_name).first()
-
-            if personnel and client:
-                personnel_name = personnel.name
-                personnel_surname = personnel.surname
-                client_port = client.port
-                client_host = client.host
-
-                message = {
-                    "action": "SAVE",
-                    "personnel": {
-                        "name": personnel_name,
-                        "surname": personnel_surname,
-                        "ssn": ssn
-                    }
-                }
-
-                message_json = json.dumps(message)
-                new_message = Message(client_id=client.id, payload=message_json)
-                session.add(new_message)
-                session.commit()
-
-                send_message_to_client(message_json, client_host, client_port)
-
-                print(f"Used {personnel_name} {personnel_surname} and {client_port} {client_host}")
+            result = push_personnel("SAVE", [ssn], [client_name])
+            print_push_result(result)
 
+            if result.messages:
                 break
-            else:
-                if not personnel:
-                    print("Personnel not found. Please try again.")
-                if not client:
-                    print("Client not found. Please try again.")
+            print("Please try again.")
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Error occurred while getting client/personnel from the database: {e}")
-        finally:
-            session.close()
 
 def send_specific_personnel_to_all_clients():
     while True:
         ssn = input("Enter personnel's SSN (ex: 123-45-6789): ")
 
-        session = Session()
-
         try:
-            personnel = session.query(Personnel).filter_by(ssn=ssn).first()
-            if personnel:
-                personnel_name = personnel.name
-                personnel_surname = personnel.surname
-
-                message = {
-                    "action": "SAVE",
-                    "personnel": {
-                        "name": personnel_name,
-                        "surname": personnel_surname,
-                        "ssn": ssn
-                    }
-                }
-
-                message_json = json.dumps(message)
-
-                all_clients = session.query(Client).all()
-
-                for client in all_clients:
-                    client_host = client.host
-                    client_port = client.port
-
-                    new_message = Message(client_id=client.id, payload=message_json)
-                    session.add(new_message)
-                    session.commit()
-
-                    send_message_to_client(message_json, client_host, client_port)
+            result = push_personnel("SAVE", [ssn])
+            print_push_result(result)
 
+            if not result.missing_personnel:
                 break
-            else:
-                print("Personnel not found. Please try again.")
-
+            print("Please try again.")
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Error occurred while getting client/personnel from the database: {e}")
-        finally:
-            session.close()
 
-def send_all_personnel_to_all_clients():
+def send_to_clients(message_json, clients, operation_id=None, action=None):
+    report = broadcast_message(message_json, clients, operation_id, action)
 
-    session = Session()
-
-    try:
-        all_personnel = session.query(Personnel).all()
-        all_clients = session.query(Client).all()
+    delivered = set(report.delivered)
+    return [client for client in clients if (client.host, client.port) in delivered], report
 
-        message = {
-            "action": "SAVE_ALL",
-            "personnel": []
+def generate_snapshot_chunks(snapshot_id, after_id, first_seq):
+    # Each chunk is its own keyset page in a short session, so no connection or transaction is held while chunks are sent;
+    # a page's last id is both the next page's start and the client's resume point.
+    seq = first_seq
+    last_id = after_id
+    while True:
+        with session_scope() as session:
+            rows = session.execute(
+                select(Personnel.id, Personnel.name, Personnel.surname, Personnel.ssn)
+                .where(Personnel.id > last_id)
+                .order_by(Personnel.id)
+                .limit(SNAPSHOT_CHUNK_SIZE)
+            ).all()
+
+        if not rows:
+            return
+
+        last_id = rows[-1].id
+        chunk = {
+            "action": "SNAPSHOT_CHUNK",
+            "snapshot_id": snapshot_id,
+            "seq": seq,
+            "last_id": last_id,
+            "personnel": [{"name": row.name, "surname": row.surname, "ssn": row.ssn} for row in rows]
         }
+        yield json.dumps(chunk)
+        seq += 1
+
+        if len(rows) < SNAPSHOT_CHUNK_SIZE:
+            return
+
+def stream_snapshot(clients, revision, snapshot_id=None, after_id=0, first_seq=0):
+    # A snapshot of the current revision is serialized once and its chunks are reused until the roster changes.
+    cached = personnel_cache.get_snapshot(revision)
+    if cached is not None and snapshot_id in (None, cached.snapshot_id):
+        snapshot_id = cached.snapshot_id
+        chunks = cached.chunks[first_seq:]
+        streamed_chunks = None
+        built_chunks = None
+    else:
+        if snapshot_id is None:
+            snapshot_id = uuid.uuid4().hex
+        chunks = streamed_chunks = generate_snapshot_chunks(snapshot_id, after_id, first_seq)
+        built_chunks = [] if after_id == 0 else None
+
+    begin = {
+        "action": "SNAPSHOT_BEGIN",
+        "snapshot_id": snapshot_id,
+        "revision": revision
+    }
+
+    message_log.log([client.id for client in clients], json.dumps(begin))
+    clients, report = send_to_clients(json.dumps(begin), clients)
+    failed = dict(report.failed)
+
+    seq = first_seq
+    for chunk_json in chunks:
+        if not clients:
+            built_chunks = None
+            break
+
+        if built_chunks is not None:
+            built_chunks.append(chunk_json)
+
+        clients, report = send_to_clients(chunk_json, clients)
+        failed.update(report.failed)
+        seq += 1
+
+    if streamed_chunks is not None:
+        streamed_chunks.close()
+    if built_chunks is not None:
+        personnel_cache.store_snapshot(revision, snapshot_id, built_chunks)
+
+    end = {
+        "action": "SNAPSHOT_END",
+        "snapshot_id": snapshot_id,
+        "revision": revision,
+        "chunks": seq
+    }
+
+    # Only the end of a snapshot is acknowledged; it is the point where the client has the whole roster.
+    operation_id, end_json = prepare_message(end)
+    message_log.log([client.id for client in clients], end_json, operation_id)
+    clients, report = send_to_clients(end_json, clients, operation_id, "SNAPSHOT_END")
+    report.failed.update(failed)
+    mark_synced(report, revision)
+
+    return report
+
+def build_delta_message(session, from_revision, revision):
+    changes = (
+        session.query(PersonnelChange)
+        .filter(PersonnelChange.id > from_revision, PersonnelChange.id <= revision)
+        .order_by(PersonnelChange.id)
+        .all()
+    )
+
+    # Only the last change of each SSN matters to the client.
+    latest_changes = {}
+    for change in changes:
+        latest_changes[change.ssn] = change
+
+    message = {
+        "action": "SYNC",
+        "from_revision": from_revision,
+        "revision": revision,
+        "upserts": [],
+        "deletes": []
+    }
+
+    for ssn, change in latest_changes.items():
+        if change.operation == "DELETE":
+            message["deletes"].append(ssn)
+        else:
+            message["upserts"].append({"name": change.name, "surname": change.surname, "ssn": ssn})
 
-        for personnel in all_personnel:
-            personnel_info = {
-                "name": personnel.name,
-                "surname": personnel.surname,
-                "ssn": personnel.ssn
-            }
-            message["personnel"].append(personnel_info)
+    return message
 
-        message_json = json.dumps(message)
+def mark_synced(report, revision):
+    for client_host, client_port in report.delivered:
+        connection = connected_clients.get_by_address(client_host, client_port)
+        if connection is not None:
+            connection.sync_revision = revision
+            connection.snapshot_progress = None
 
-        for client in all_clients:
-            client_host = client.host
-            client_port = client.port
+def mark_unsynced(report):
+    # Targeted pushes take a client's roster off the revision it synced to, so its next sync is a snapshot.
+    for client_host, client_port in report.delivered:
+        connection = connected_clients.get_by_address(client_host, client_port)
+        if connection is not None:
+            connection.sync_revision = None
+            connection.snapshot_progress = None
 
-            new_message = Message(client_id=client.id, payload=message_json)
-            session.add(new_message)
-            session.commit()
+def send_all_personnel_to_all_clients():
+    try:
+        revision, disconnected, up_to_date, reports = sync_all_personnel()
 
-            send_message_to_client(message_json, client_host, client_port)
+        if disconnected:
+            print(f"{disconnected} client(s) are not connected")
+        if up_to_date:
+            print(f"{up_to_date} client(s) already at revision {revision}")
+        for label, report in reports:
+            print(f"{label}: {report.summary()}")
 
     except SQLAlchemyError as e:
-        session.rollback()
         print(f"Error occurred while getting client/personnel from the database: {e}")
-    finally:
-        session.close()
 
 def delete_specific_personnel_from_client():
     while True:
@@ -314,120 +1552,143 @@ def delete_specific_personnel_from_client():
 
         client_name = input("Enter client's name: ")
 
-        session = Session()
-        
         try:
-            personnel = session.query(Personnel).filter_by(ssn=ssn).first()
-            client = session.query(Client).filter_by(name=client_name).first()
-
-            if personnel and client:
-                client_port = client.port
-                client_host = client.host
-
-                message = {
-                    "action": "DELETE",
-                    "personnel": {
-                        "ssn": ssn
-                    }
-                }
-
-                message_json = json.dumps(message)
-                new_message = Message(client_id=client.id, payload=message_json)
-                session.add(new_message)
-                session.commit()
-
-                send_message_to_client(message_json, client_host, client_port)
+            result = push_personnel("DELETE", [ssn], [client_name])
+            print_push_result(result)
 
+            if result.messages:
                 break
-            else:
-                if not personnel:
-                    print("Personnel not found. Please try again.")
-                if not client:
-                    print("Client not found. Please try again.")
+            print("Please try again.")
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Error occurred while getting client/personnel from the database: {e}")
-        finally:
-            session.close()
 
 def delete_specific_personnel_from_all_clients():
     while True:
         ssn = input("Enter personnel's SSN (ex: 123-45-6789): ")
 
-        session = Session()
-
         try:
-            personnel = session.query(Personnel).filter_by(ssn=ssn).first()
-
-            if personnel:
-                message = {
-                    "action": "DELETE",
-                    "personnel": {
-                        "ssn": ssn
-                    }
-                }
-
-                message_json = json.dumps(message)
-
-                all_clients = session.query(Client).all()
-
-                for client in all_clients:
-                    client_host = client.host
-                    client_port = client.port
-
-                    new_message = Message(client_id=client.id, payload=message_json)
-                    session.add(new_message)
-                    session.commit()
-
-                    send_message_to_client(message_json, client_host, client_port)
+            result = push_personnel("DELETE", [ssn])
+            print_push_result(result)
 
+            if not result.missing_personnel:
                 break
-            else:
-                print("Personnel not found. Please try again.")
-
+            print("Please try again.")
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Error occurred while getting client/personnel from the database: {e}")
-        finally:
-            session.close()
 
 def delete_all_personnel_from_all_clients():
+    try:
+        report = clear_all_personnel()
+        print(report.summary())
 
-    session = Session()
+    except SQLAlchemyError as e:
+        print(f"Error occurred while getting client from the database: {e}")
 
+def push_result_to_dict(result):
+    return {
+        "messages": result.messages,
+        **result.report.to_dict(),
+        "missing_personnel": result.missing_personnel,
+        "missing_clients": result.missing_clients,
+    }
+
+def control_table(params):
+    table = params.get("table")
+    if table not in TABLES:
+        raise ControlRequestError(f"'table' must be one of {', '.join(TABLES)}")
+    return get_table_rows(table)
+
+def control_push(action):
+    def handler(params):
+        result = push_personnel(action, string_list(params, "ssns"), string_list(params, "clients", required=False))
+        return push_result_to_dict(result)
+    return handler
+
+def control_sync(params):
+    revision, disconnected, up_to_date, reports = sync_all_personnel()
+    return {
+        "revision": revision,
+        "disconnected": disconnected,
+        "up_to_date": up_to_date,
+        "reports": [{"label": label, **report.to_dict()} for label, report in reports],
+    }
+
+def control_clear(params):
+    return clear_all_personnel().to_dict()
+
+def control_deliveries(params):
     try:
-        message = {
-            "action": "DELETE_ALL"
-        }
-
-        message_json = json.dumps(message)
+        limit = int(params.get("limit", 100))
+    except (TypeError, ValueError):
+        raise ControlRequestError("'limit' must be an integer")
+    if limit <= 0:
+        raise ControlRequestError("'limit' must be positive")
+    return {"stats": delivery_tracker.stats(), "failed": delivery_tracker.failed_deliveries(limit)}
+
+def control_retry(params):
+    retried, skipped, report = retry_failed_deliveries()
+    return {"retried": retried, "skipped": skipped, **report.to_dict()}
+
+def control_compact(params):
+    try:
+        max_age = float(params["days"]) * 86400 if params.get("days") is not None else None
+        max_rows = int(params["rows"]) if params.get("rows") is not None else None
+    except (TypeError, ValueError):
+        raise ControlRequestError("'days' and 'rows' must be numbers")
+
+    message_log.flush()
+    rows, payloads = message_log.compact(max_age, max_rows)
+    return {"messages": rows, "payloads": payloads}
+
+def start_control_server():
+    routes = {
+        ("GET", "/table"): control_table,
+        ("GET", "/stats"): lambda params: get_server_stats(),
+        ("POST", "/send"): control_push("SAVE"),
+        ("POST", "/delete"): control_push("DELETE"),
+        ("POST", "/sync"): control_sync,
+        ("POST", "/delete-all"): control_clear,
+        ("GET", "/deliveries"): control_deliveries,
+        ("POST", "/retry"): control_retry,
+        ("POST", "/compact"): control_compact,
+        ("GET", "/metrics"): lambda params: TextResponse(CONTENT_TYPE, render_metrics()),
+    }
+
+    control_server = ControlServer(CONTROL_HOST, CONTROL_PORT, routes, CONTROL_TOKEN, CONTROL_MAX_BODY_SIZE)
+    control_server.start()
+    return control_server
 
-        all_clients = session.query(Client).all()
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
-        for client in all_clients:
-            client_host = client.host
-            client_port = client.port
+    if DB_POOL_SIZE + DB_MAX_OVERFLOW < DB_WORKERS + BACKGROUND_DB_THREADS:
+        logger.warning(
+            "DB_POOL_SIZE + DB_MAX_OVERFLOW (%d) is below DB_WORKERS + %d background threads; database work may wait for connections",
+            DB_POOL_SIZE + DB_MAX_OVERFLOW, BACKGROUND_DB_THREADS
+        )
 
-            new_message = Message(client_id=client.id, payload=message_json)
-            session.add(new_message)
-            session.commit()
+    # The control API can push to and clear every client, so it is never served without a token.
+    if CONTROL_ENABLED and not CONTROL_TOKEN:
+        raise SystemExit("CONTROL_ENABLED=true needs CONTROL_TOKEN to be set")
 
-            send_message_to_client(message_json, client_host, client_port)
+    delete_anonymous_clients()
 
-    except SQLAlchemyError as e:
-        session.rollback()
-        print(f"Error occurred while getting client from the database: {e}")
-    finally:
-        session.close()            
+    server = None
+    if SERVER_WORKERS > 1:
+        start_workers(SERVER_WORKERS)
+        print(f"Server listening on {SERVER_HOST}:{SERVER_PORT} with {SERVER_WORKERS} worker processes")
+    else:
+        server = start_server_loop()
+        print(f"Server listening on {SERVER_HOST}:{SERVER_PORT}")
+    message_log.start()
 
-def main():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((SERVER_HOST, SERVER_PORT))
-    server_socket.listen(5)
-    print(f"Server listening on {SERVER_HOST}:{SERVER_PORT}")
+    if CLIENT_EXPIRY_DAYS > 0:
+        threading.Thread(target=run_client_expiry, name="client-expiry", daemon=True).start()
 
-    connection_thread = threading.Thread(target=accept_connections, args=(server_socket,))
-    connection_thread.start()
+    control_server = None
+    if CONTROL_ENABLED:
+        control_server = start_control_server()
+        print(f"Control API listening on http://{CONTROL_HOST}:{control_server.address[1]}")
 
     try:
         while True:
@@ -449,7 +1710,11 @@ def main():
                     print("Enter 1 to show clients table")
                     print("Enter 2 to show personnel table")
                     print("Enter 3 to show messages table")
-                    choice = int(input("Enter the number you want to perform (0, 1, 2, 3): "))
+                    print("Enter 4 to show personnel cache statistics")
+                    print("Enter 5 to show database connection pool statistics")
+                    print("Enter 6 to show compression statistics")
+                    print("Enter 7 to show delivery statistics")
+                    choice = int(input("Enter the number you want to perform (0, 1, 2, 3, 4, 5, 6, 7): "))
                     if choice == 0:
                         break
                     else:
@@ -480,8 +1745,16 @@ def main():
 
     except KeyboardInterrupt:
         print("Server shutting down")
-        server_socket.close()
 
+    if control_server is not None:
+        control_server.stop()
+    if server is not None:
+        stop_server_loop(server)
+    else:
+        stop_workers()
+    client_expiry_stopped.set()
+    db_executor.shutdown()
+    message_log.stop()
     quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import base64
+import itertools
+import os
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+CIPHER_AES_GCM = "aes-gcm"
+CIPHER_CHACHA20 = "chacha20-poly1305"
+
+AEAD_CLASSES = {
+    CIPHER_AES_GCM: AESGCM,
+    CIPHER_CHACHA20: ChaCha20Poly1305,
+}
+
+SUPPORTED_CIPHERS = tuple(AEAD_CLASSES)
+
+DIRECTION_TO_CLIENT = "server-to-client"
+DIRECTION_TO_SERVER = "client-to-server"
+
+HANDSHAKE_NONCE_SIZE = 16
+NONCE_PREFIX = struct.Struct("!I")
+NONCE_COUNTER = struct.Struct("!Q")
+NONCE_SIZE = NONCE_PREFIX.size + NONCE_COUNTER.size
+
+def choose_cipher(offered, preference):
+    for name in preference:
+        if name in (offered or ()) and name in AEAD_CLASSES:
+            return name
+    return None
+
+def new_handshake_nonce():
+    return os.urandom(HANDSHAKE_NONCE_SIZE)
+
+def derive_session_key(shared_key, name, client_nonce, server_nonce, direction):
+    # Both sides mix their fresh nonces into the shared Fernet key, so every connection gets its own key,
+    # and each direction gets a separate one so a frame can never be reflected back to its sender.
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=client_nonce + server_nonce,
+        info=f"personnel-transport {direction} {name}".encode(),
+    )
+    return hkdf.derive(base64.urlsafe_b64decode(shared_key))
+
+class SessionCipher:
+    def __init__(self, name, shared_key, client_nonce, server_nonce, direction=DIRECTION_TO_CLIENT):
+        self.name = name
+        self.aead = AEAD_CLASSES[name](derive_session_key(shared_key, name, client_nonce, server_nonce, direction))
+
+        # A random prefix and a counter make every nonce unique for the life of the key without coordination.
+        self._nonce_prefix = os.urandom(NONCE_PREFIX.size)
+        self._counter = itertools.count()
+        self._last_received = -1
+
+    def encrypt(self, payload, message_type, flags):
+        nonce = self._nonce_prefix + NONCE_COUNTER.pack(next(self._counter))
+        return nonce + self.aead.encrypt(nonce, payload, bytes([message_type, flags]))
+
+    def decrypt(self, data, message_type, flags):
+        # The frame type and flags are authenticated too, so a flipped compression bit fails the tag check.
+        payload = self.aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], bytes([message_type, flags]))
+
+        # Frames are sent in the order they were encrypted, so a counter that doesn't go up is a replayed frame.
+        # It is checked after the tag, so a forged frame can't move it.
+        (counter,) = NONCE_COUNTER.unpack_from(data, NONCE_PREFIX.size)
+        if counter <= self._last_received:
+            raise ValueError(f"frame counter {counter} is not above {self._last_received}")
+        self._last_received = counter
+        return payload
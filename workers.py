@@ -0,0 +1,128 @@
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class ChannelClosed(Exception):
+    pass
+
+class RemoteError(Exception):
+    pass
+
+class Channel:
+    def __init__(self, pipe, on_message, on_close=None, name="channel"):
+        # on_message(channel, kind, request_id, args) runs on the reader thread; request_id is None for notices.
+        self.pipe = pipe
+        self.on_message = on_message
+        self.on_close = on_close
+        self.name = name
+        self.closed = False
+
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        self._request_ids = itertools.count(1)
+        self._reader = None
+
+    def __repr__(self):
+        return f"<Channel({self.name}, pending={len(self._pending)})>"
+
+    def start(self):
+        self._reader = threading.Thread(target=self._read, name=f"{self.name}-reader", daemon=True)
+        self._reader.start()
+
+    def close(self):
+        self.pipe.close()
+
+    def _send(self, message):
+        with self._send_lock:
+            self.pipe.send(message)
+
+    def request(self, kind, *args):
+        future = Future()
+        request_id = next(self._request_ids)
+
+        with self._pending_lock:
+            if self.closed:
+                future.set_exception(ChannelClosed(f"{self.name} is closed"))
+                return future
+            self._pending[request_id] = future
+
+        try:
+            self._send(("request", kind, request_id, args))
+        except (OSError, ValueError) as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            future.set_exception(ChannelClosed(str(e) or f"{self.name} is closed"))
+
+        return future
+
+    def notify(self, kind, *args):
+        try:
+            self._send(("notice", kind, None, args))
+        except (OSError, ValueError):
+            # The reader notices the closed pipe and reports it through on_close.
+            pass
+
+    def reply(self, request_id, result=None, error=None):
+        try:
+            self._send(("reply", error, request_id, result))
+        except (OSError, ValueError):
+            pass
+
+    def _read(self):
+        try:
+            while True:
+                message_type, kind, request_id, payload = self.pipe.recv()
+
+                if message_type == "reply":
+                    with self._pending_lock:
+                        future = self._pending.pop(request_id, None)
+                    if future is None:
+                        continue
+                    if kind is not None:
+                        future.set_exception(RemoteError(kind))
+                    else:
+                        future.set_result(payload)
+                    continue
+
+                try:
+                    self.on_message(self, kind, request_id, payload)
+                except Exception as e:
+                    logger.exception("Error handling %s from %s", kind, self.name)
+                    if request_id is not None:
+                        self.reply(request_id, error=f"{type(e).__name__}: {e}")
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._pending_lock:
+                self.closed = True
+                pending = list(self._pending.values())
+                self._pending.clear()
+
+            for future in pending:
+                future.set_exception(ChannelClosed(f"{self.name} closed"))
+            if self.on_close is not None:
+                self.on_close(self)
+
+class RemoteConnection:
+    def __init__(self, worker, host, port, state):
+        # The coordinator's view of a client connected to a worker process: enough to route, sync and track deliveries.
+        self.worker = worker
+        self.host = host
+        self.port = port
+        self.client_id = None
+        self.client_name = None
+        self.sync_revision = state.get("revision", 0)
+        self.snapshot_progress = state.get("snapshot")
+        self.acks = bool(state.get("acks"))
+        self.closed = False
+
+    def __repr__(self):
+        return f"<RemoteConnection({self.host}:{self.port}, worker={self.worker.name})>"
+
+    @property
+    def address(self):
+        return (self.host, self.port)